@@ -1,8 +1,9 @@
 import dash
-import serial
 import os
-from dash import _dash_renderer, html, dcc, Input, Output, callback
-import pandas as pd
+import json
+import math
+from dash import _dash_renderer, html, dcc, Input, Output, State, ClientsideFunction, Patch, callback, no_update
+from functools import lru_cache
 import threading
 import dash_draggable
 import dash_mantine_components as dmc
@@ -10,9 +11,21 @@ import dash_daq as daq
 import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 import dash_vtk
-from dash_vtk.utils import to_mesh_state
-from vtkmodules.vtkFiltersSources import vtkCylinderSource
-import vtk
+import time
+from buffers import make_sensor_buffers
+from schema import ReadingParser
+from charts import chart_update, overlay_update
+from streaming import Broadcaster
+from shared import SharedControl, attach_link_buffers
+from metrics import REGISTRY, timed
+from archive import META_FILE, ArchiveSink, FlightArchive
+from query import LiveBlockIndex, aggregate_result, combine
+import ingest
+from ingest import (
+    ARCHIVE_DIR, BUFFER_CAPACITY, LINKS, PROTOCOL, SHM_PREFIX, SPILL, SPILL_DIR, chart_pyramids, derived_metrics, open_link, recover_link,
+    register_link_metrics, spill_writer, start_logs, start_spills, start_writers
+)
+from flask import Response, request, stream_with_context
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
@@ -24,62 +37,340 @@ app = dash.Dash(
     external_stylesheets=external_stylesheets
 )
 
-SERIAL_PORT = 'COM5'
-BAUD_RATE = 115200
+# 'thread' reads the links in this process, 'shared' attaches to the buffers
+# of a separately running `python ingest.py` (see ingest.py)
+INGEST_MODE = os.environ.get('SATDASH_INGEST', 'thread')
+# seconds to wait for ingest.py to create its buffers in 'shared' mode
+INGEST_WAIT = float(os.environ.get('SATDASH_INGEST_WAIT', 30))
+# link picker choice that overlays every link
+ALL_LINKS = 'all'
+LINK_COLORS = ['orange.7', 'cyan.6', 'lime.6', 'grape.6', 'yellow.5', 'red.7']
+# most recent points shown on the area charts
+CHART_WINDOW = int(os.environ.get('SATDASH_CHART_WINDOW', 2000))
+# show the whole flight on the area charts, downsampled to at most CHART_MAX_POINTS
+# min/max points, instead of only the last CHART_WINDOW readings
+CHART_DOWNSAMPLE = os.environ.get('SATDASH_CHART_DOWNSAMPLE', '1') == '1'
+CHART_MAX_POINTS = int(os.environ.get('SATDASH_CHART_MAX_POINTS', 500))
+# send only new chart points each tick instead of the whole window
+CHART_DELTA_UPDATES = os.environ.get('SATDASH_CHART_DELTA', '1') == '1'
+# refresh period of each widget in ms
+REFRESH_INTERVALS = {
+    'temp_chart': 250,
+    'pressure_chart': 250,
+    'thermometer': 100,
+    'pressure_gauge': 100,
+    'velocity_display': 100,
+    'light_display': 200,
+    'accelerometer_gauge': 100,
+    'gyro': 50,
+    'can3d': 35,
+    'altitude_display': 100,
+}
+# 'poll' refreshes widgets with dcc.Interval, 'sse' pushes updates over /stream
+TRANSPORT = os.environ.get('SATDASH_TRANSPORT', 'poll')
+# rotate the 3D can in the browser (assets/can3d.js) instead of re-sending its mesh
+CAN3D_CLIENT_TRANSFORM = os.environ.get('SATDASH_CAN3D_CLIENT', '1') == '1'
+# angle resolution in degrees of the server-side mesh cache used otherwise
+CAN3D_ANGLE_STEP = 1.0
+# turn the 3D can by the smoothed orientation (derived.py) instead of the raw gyroscope angles
+CAN3D_SMOOTHED = os.environ.get('SATDASH_CAN3D_SMOOTHED', '1') == '1'
+CAN3D_READING = 'orientation' if CAN3D_SMOOTHED else 'gyroscope'
+# show the live timing counters as a draggable tile
+DIAGNOSTICS_PANEL = os.environ.get('SATDASH_DIAGNOSTICS', '0') == '1'
+# where the can mesh is cached, so startup does not need to import VTK
+CACHE_DIR = os.environ.get('SATDASH_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+# the can: a cylinder of this resolution, height and radius
+CAN_MESH = {'resolution': 100, 'height': 1.5, 'radius': 0.5}
+
+def make_chart_pyramids(buffers):
+    return chart_pyramids(buffers) if CHART_DOWNSAMPLE else {}
+
+def attach_links():
+    # buffers of a running ingest.py, waiting a little for it to start
+    deadline = time.monotonic() + INGEST_WAIT
+    while True:
+        try:
+            control = SharedControl.attach(SHM_PREFIX)
+            return control, {link: attach_link_buffers(SHM_PREFIX, link) for link in LINKS}
+        except FileNotFoundError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"No '{SHM_PREFIX}' ingest buffers found, start `python ingest.py` first")
+            print("Waiting for ingest.py...")
+            time.sleep(1)
 
-data = pd.DataFrame(columns=['time', 'sensor_type', 'value'])
+# every link has its own buffers, written only by its own reader, so a slow
+# or stalled link never holds up the others. In 'shared' mode start_ingest()
+# swaps them for the buffers of ingest.py.
+link_buffers = {link: make_sensor_buffers(BUFFER_CAPACITY) for link in LINKS}
+# downsampled history of the charted sensors, updated by the reader threads
+link_pyramids = {link: make_chart_pyramids(link_buffers[link]) for link in LINKS}
+# altitude, vertical velocity and orientation, also updated by the reader threads
+link_derived = {link: derived_metrics(link_buffers[link]) for link in LINKS}
+parsers = {link: ReadingParser() for link in LINKS}
+# filled in by start_ingest()
+connections = {}
+writers = {}
+logs = {}
+spills = {}
+ingest_control = None
+broadcaster = None
 
-serial_connection = serial.Serial(SERIAL_PORT, BAUD_RATE)
+# the first link is selected by default
+DEFAULT_LINK = next(iter(LINKS))
+buffers = link_buffers[DEFAULT_LINK]
+pyramids = link_pyramids[DEFAULT_LINK]
+derived = link_derived[DEFAULT_LINK]
+parser = parsers[DEFAULT_LINK]
+serial_connection = None
+writer = None
 previous_clicks = 0
-data_lock = threading.Lock()
 
+mesh_state_timer = REGISTRY.timer('satdash_mesh_state_seconds', "Time spent in to_mesh_state")
+
+
+@lru_cache(maxsize=1)
+def can_poly_data():
+    from vtkmodules.vtkFiltersSources import vtkCylinderSource
+    cylinder_source = vtkCylinderSource()
+    cylinder_source.SetResolution(CAN_MESH['resolution'])
+    cylinder_source.SetHeight(CAN_MESH['height'])
+    cylinder_source.SetRadius(CAN_MESH['radius'])
+    cylinder_source.SetCenter(0, 0, 0)
+    cylinder_source.Update()
+    return cylinder_source.GetOutput()
+
+def load_mesh_state():
+    # The can's mesh state, from the cache when it was built before. Only a
+    # cache miss imports VTK, which is the slowest part of starting up.
+    path = os.path.join(CACHE_DIR, 'can_mesh_{resolution}_{height}_{radius}.json'.format(**CAN_MESH))
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    from dash_vtk.utils import to_mesh_state
+    with mesh_state_timer.time():
+        state = to_mesh_state(can_poly_data())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(state, f)
+    except OSError as e:
+        print(f"Could not cache the can mesh: {e}")
+    return state
 
-cylinder_source = vtkCylinderSource()
-cylinder_source.SetResolution(100)
-cylinder_source.SetHeight(1.5)
-cylinder_source.SetRadius(0.5)
-cylinder_source.SetCenter(0, 0, 0)
-cylinder_source.Update()
-poly_data = cylinder_source.GetOutput()
-mesh_state = to_mesh_state(poly_data)
+mesh_state = load_mesh_state()
 
-angle_x = 0
-angle_y = 0
-angle_z = 0
+def notifier(link):
+    # only the default link is streamed over SSE
+    return broadcaster.notify if broadcaster is not None and link == DEFAULT_LINK else None
 
-def read_serial():
-    global data
+def read_text(connection, link=None):
+    link = link or DEFAULT_LINK
+    ingest.read_text(
+        connection, link_buffers[link], link_pyramids[link], parsers[link], link, notifier(link), link_derived[link]
+    )
+
+def read_binary(connection, link=None):
+    link = link or DEFAULT_LINK
+    ingest.read_binary(
+        connection, link_buffers[link], link_pyramids[link], parsers[link], link, notifier(link), link_derived[link]
+    )
+
+def read_serial(connection=None, link=None):
+    link = link or DEFAULT_LINK
+    connection = connection or connections[link]
+    if PROTOCOL == 'binary':
+        read_binary(connection, link)
+    else:
+        read_text(connection, link)
+
+def watch_shared_buffers():
+    # with a separate ingest process nobody calls notify(), so poll the totals
+    totals = {sensor: buffer.total for sensor, buffer in buffers.items()}
     while True:
-        try:
-            code = serial_connection.readline().decode('utf-8').strip()
-
-            if code == 'panditas':
-                
-                print ('Correct code')
-                
-                time = serial_connection.readline().decode('utf-8').strip()
-                sensor_type = serial_connection.readline().decode('utf-8').strip()
-                value = serial_connection.readline().decode('utf-8').strip()
-
-                new_row = pd.DataFrame({
-                    'time': [time],
-                    'sensor_type': [sensor_type],
-                    'value': [value]
-                })
-
-                with data_lock:
-                    data = pd.concat([data, new_row], ignore_index=True)
-                    # data.to_csv('data.csv', index=False)  
-                        
-                    print(f"Stored Data: {data}")
-            
-            else: 
-                print('Incorrect code')
-                
-        except (IndexError, ValueError) as e:
-            print(f"Error parsing data: {e}")
-                       
-threading.Thread(target=read_serial, daemon=True).start()
+        time.sleep(broadcaster.frame_interval)
+        changed = [sensor for sensor, buffer in buffers.items() if buffer.total != totals[sensor]]
+        for sensor in changed:
+            totals[sensor] = buffers[sensor].total
+        if changed:
+            broadcaster.notify(changed)
+
+_start_lock = threading.Lock()
+_started = False
+
+def start_ingest():
+    # Opens the telemetry links and starts the reader, writer and broadcast
+    # threads, or attaches to the buffers of a running ingest.py. Runs once,
+    # when the server starts, so importing this module never opens the serial
+    # port or the packet logs and archives. The only disk access on import is
+    # the can mesh cache (load_mesh_state), written on its first run.
+    global _started, buffers, pyramids, derived, serial_connection, writer, ingest_control, broadcaster
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+        if INGEST_MODE == 'shared':
+            ingest_control, attached = attach_links()
+            link_buffers.update({link: attached[link][0] for link in LINKS})
+            # downsampled history of the charted sensors, kept up to date by ingest.py
+            link_pyramids.update({link: attached[link][1] if CHART_DOWNSAMPLE else {} for link in LINKS})
+            link_derived.update({link: attached[link][2] for link in LINKS})
+            parsers.clear()
+        else:
+            for link in LINKS:
+                spill = spill_writer(link, link_buffers[link])
+                if spill is not None:
+                    spills[link] = spill
+                recover_link(link, link_buffers[link], link_pyramids[link], link_derived[link], spill)
+            connections.update({link: open_link(*LINKS[link]) for link in LINKS})
+            writers.update(start_writers(link_buffers))
+            logs.update(start_logs(link_buffers))
+            start_spills(spills)
+
+        buffers = link_buffers[DEFAULT_LINK]
+        pyramids = link_pyramids[DEFAULT_LINK]
+        derived = link_derived[DEFAULT_LINK]
+        serial_connection = connections.get(DEFAULT_LINK)
+        writer = writers.get(DEFAULT_LINK)
+
+        if TRANSPORT == 'sse':
+            broadcaster = Broadcaster(buffers, history_sensors=('temperature', 'pressure'), window=CHART_WINDOW)
+            broadcaster.start()
+
+        for link in LINKS:
+            register_link_metrics(
+                link, link_buffers[link], writers.get(link), parsers.get(link), connections.get(link),
+                link_pyramids[link], link_derived[link], spills.get(link)
+            )
+
+        # one reader thread per link
+        if INGEST_MODE == 'shared':
+            if broadcaster is not None:
+                threading.Thread(target=watch_shared_buffers, daemon=True).start()
+        else:
+            for link in LINKS:
+                threading.Thread(target=read_serial, kwargs={'link': link}, name=f'reader-{link}', daemon=True).start()
+
+def create_server():
+    # WSGI entry point, e.g. `gunicorn 'app:create_server()'`
+    start_ingest()
+    return app.server
+
+@timed('satdash_figure_seconds', "Time spent building Plotly figures", figure='pressure_gauge')
+def pressure_gauge_figure(latest_pressure):
+    gauge_pressure_fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=latest_pressure,
+        gauge={
+            'axis': {'range': [None, 100], 'tickcolor': 'white'},
+            'bar': {'color': '#d8eaff'},
+            'steps': [
+                {'range': [0, 50], 'color': '#2e547f'},
+                {'range': [50, 100], 'color': '#61c3df'},
+            ]
+        }
+    ))
+
+    gauge_pressure_fig.update_layout(
+        paper_bgcolor='#0f1d39', 
+        font_color='white', 
+        margin=dict(l=30, r=40, t=0, b=10)
+    )
+    return gauge_pressure_fig
+
+def velocity_values(latest_velocity):
+    return [abs(latest_velocity)/5*100, 100 - abs(latest_velocity)/5*100]
+
+@timed('satdash_figure_seconds', "Time spent building Plotly figures", figure='velocity_display')
+def velocity_figure(latest_velocity):
+    velocity_display_fig = go.Figure(
+        data=[go.Pie(
+            values=velocity_values(latest_velocity),
+            hole=.6,
+            marker=dict(colors=['#432267', '#b463b1']),
+            textinfo='none',
+            direction='clockwise',
+            hoverinfo='none'
+            )
+        ]
+    )
+
+    velocity_display_fig.update_layout(    
+        paper_bgcolor='#0f1d39', 
+        font_color='white',
+        showlegend=False,
+        margin=dict(l=0, r=0, t=0, b=0),
+        annotations=[
+            dict(
+                x=0.5,
+                y=0.5,  
+                text=f"{abs(latest_velocity):.1f}",
+                font=dict(size=14, color="white"),  
+                showarrow=False
+            )
+        ]
+    )
+    return velocity_display_fig
+
+# the figures are built and validated once, callbacks only patch the changing values
+pressure_gauge_template = pressure_gauge_figure(0)
+velocity_template = velocity_figure(0)
+
+def pressure_gauge_patch(latest_pressure):
+    patch = Patch()
+    patch['data'][0]['value'] = latest_pressure
+    return patch
+
+def velocity_patch(latest_velocity):
+    patch = Patch()
+    patch['data'][0]['values'] = velocity_values(latest_velocity)
+    patch['layout']['annotations'][0]['text'] = f"{abs(latest_velocity):.1f}"
+    return patch
+
+def stays_polled(widget):
+    # The 'sse' transport only streams the raw sensors, so widgets showing
+    # derived metrics are still polled: the altitude tile, and the can when it
+    # follows the smoothed orientation or its mesh is rendered on the server.
+    if widget == 'can3d':
+        return CAN3D_SMOOTHED or not CAN3D_CLIENT_TRANSFORM
+    return widget == 'altitude_display'
+
+def stream_config():
+    if TRANSPORT != 'sse':
+        return None
+    return {
+        'url': '/stream',
+        'window': CHART_WINDOW,
+        # the stream rotates the can by the raw gyroscope readings unless it is polled
+        'can3d_client': CAN3D_CLIENT_TRANSFORM and not stays_polled('can3d'),
+        # static figures the client fills in with the latest values
+        'figures': {
+            'pressure_gauge': json.loads(pressure_gauge_template.to_json()),
+            'velocity_display': json.loads(velocity_template.to_json()),
+        },
+    }
+
+diagnostics_tiles = []
+if DIAGNOSTICS_PANEL:
+    diagnostics_tiles = [
+        html.Div(
+            id = "diagnostics_div",
+            children = [
+                html.H3("Diagnostics", style={"textAlign": "center", "fontSize": "18px"}),
+                html.Pre(id='diagnostics', style={"fontSize": "10px", "color": "white", "overflow": "auto"}),
+                dcc.Interval(id='diagnostics_interval', interval=1000, n_intervals=0)
+            ],
+            style={
+                "height": '100%',
+                "width": '100%',
+                "display": "flex",
+                "flex-direction": "column",
+                "color": "white"
+            }
+        )
+    ]
 
 app.layout = dmc.MantineProvider(
     html.Div([
@@ -90,7 +381,25 @@ app.layout = dmc.MantineProvider(
                     "SatDash",
                     id = "sidebar_title"
                 ),
-                html.Button('Save Data', id='save_data_button', n_clicks=0)
+                html.Button('Save Data', id='save_data_button', n_clicks=0),
+                # which link the widgets show, hidden with a single link; the
+                # SSE transport only streams the default link
+                dcc.Dropdown(
+                    id='link_picker',
+                    options=[{'label': link, 'value': link} for link in LINKS]
+                    + ([{'label': 'All (overlay)', 'value': ALL_LINKS}] if len(LINKS) > 1 else []),
+                    value=DEFAULT_LINK,
+                    clearable=False,
+                    style={'color': '#0f1d39'} if len(LINKS) > 1 and TRANSPORT != 'sse' else {'display': 'none'}
+                ),
+                # time range the area charts are zoomed to, empty for the whole flight
+                *[
+                    dcc.Input(
+                        id=f'chart_{bound}', type='number', placeholder=placeholder, debounce=True,
+                        style={'width': '100%'} if TRANSPORT != 'sse' else {'display': 'none'}
+                    )
+                    for bound, placeholder in (('start', 'From (s)'), ('end', 'To (s)'))
+                ]
             ],
             vertical=True
         ),
@@ -181,7 +490,7 @@ app.layout = dmc.MantineProvider(
                         # Pressure gauge
                         html.Div(id = "pressure_div", children=[
                             html.H3("Current Pressure", style={"textAlign": "center", "fontSize": "18px"}, id="pressure_title"),
-                            dcc.Graph(id='pressure_gauge')
+                            dcc.Graph(id='pressure_gauge', figure=pressure_gauge_template)
                         ], style={
                             "height": '100%',  
                             "width": '100%',  
@@ -195,7 +504,7 @@ app.layout = dmc.MantineProvider(
                         # Velocity display
                         html.Div(id="velocity_div", children=[
                             html.H3("Current Velocity", style={"textAlign": "center", "fontSize": "18px"}, id="velocity_title"),
-                            dcc.Graph(id='velocity_display')
+                            dcc.Graph(id='velocity_display', figure=velocity_template)
                         ], style={
                             "height": '100%',  
                             "width": '100%',  
@@ -275,7 +584,7 @@ app.layout = dmc.MantineProvider(
                             style={"width": "100%", "height": "100%"},
                                 children=[
                                 dash_vtk.View([
-                                    dash_vtk.GeometryRepresentation([
+                                    dash_vtk.GeometryRepresentation(id='can3d_representation', children=[
                                         dash_vtk.Mesh(id='cylinder-mesh', state=mesh_state)
                                     ])
                                 ], background=[0.059,0.114,0.224], cameraPosition=[0, 0, -10]),
@@ -326,11 +635,39 @@ app.layout = dmc.MantineProvider(
                             "flex-grow": "0",
                             "align-items": "center",
                             "justify-content": "center"
-                        })                      
+                        }),
+                        # Altitude from pressure and descent rate (derived.py)
+                        html.Div(
+                            id = "altitude_div",
+                            children = [
+                                html.H3("Current Altitude", style={"textAlign": "center", "fontSize": "18px"}, id="altitude_title"),
+                                html.H2(id='altitude_display'),
+                                html.H4(id='descent_rate_display')
+                            ],
+                            style={
+                            "height": '100%',
+                            "width": '100%',
+                            "display": "flex",
+                            "flex-direction": "column",
+                            "flex-grow": "0",
+                            "align-items": "center",
+                            "justify-content": "center",
+                            "color": "white"
+                        }),
+                        *diagnostics_tiles
                     ]
                 ),
-                dcc.Interval(id='interval-component', interval=35, n_intervals=0),
-                # dcc.Interval(id='can3d-interval-component', interval=10, n_intervals=0)
+                *[
+                    dcc.Interval(id=f'{widget}_interval', interval=ms, n_intervals=0, disabled=TRANSPORT == 'sse' and not stays_polled(widget))
+                    for widget, ms in REFRESH_INTERVALS.items()
+                ],
+                # last sensor sequence number each widget has rendered, per tab
+                *[dcc.Store(id=f'{widget}_seq') for widget in REFRESH_INTERVALS if not widget.endswith('_chart')],
+                dcc.Store(id='temp_chart_cursor'),
+                dcc.Store(id='pressure_chart_cursor'),
+                dcc.Store(id='can3d_angles'),
+                dcc.Store(id='stream_config', data=stream_config()),
+                dcc.Store(id='stream_status'),
 
             ])
         ])
@@ -343,218 +680,396 @@ app.layout = dmc.MantineProvider(
 
 def save_data(n_clicks):
     if n_clicks > 0:
-        with data_lock:
-            if not data.empty:
-                for sensor_type in ['gyroscope', 'accelerometer','velocity','temperature','pressure','light']:
-                    sensor_data = data[data['sensor_type'] == sensor_type]
-                    if not sensor_data.empty:
-                        filename = f'{sensor_type}_data.csv'
-                        if os.path.exists(filename):
-                            last_entry = pd.read_csv(filename).iloc[-1]
-                            last_entry_index = sensor_data[(sensor_data == last_entry).all(axis=1)].index
-                            
-                            if not last_entry_index.empty:
-                                new_data = sensor_data.loc[last_entry_index[-1] + 1:]
-                            else:
-                                new_data = sensor_data          
-                        else:
-                            new_data = sensor_data  
-                        
-                        if not new_data.empty:
-                            new_data.to_csv(filename, mode='a', header=not os.path.exists(filename), index=False)
-                            print(f"New data appended to {filename}.")
-                        else:
-                            print(f"No new data to append for {sensor_type}.")
-                    else:
-                        print(f"No data to save for {sensor_type}.")
-            else:
-                print("No data to save.")
+        # the writer threads do the disk I/O, ingest keeps running meanwhile
+        if ingest_control is not None:
+            ingest_control.request_save()
+        for link_writer in writers.values():
+            link_writer.request_save()
     return 0
 
 
 
+def timed_callback(widget):
+    return timed('satdash_callback_seconds', "Time spent in widget callbacks", widget=widget)
+
+def source_links(source):
+    return list(LINKS) if source == ALL_LINKS else [source or DEFAULT_LINK]
+
+def reading_buffer(link, sensor_type):
+    # raw sensor buffers and derived metrics alike
+    if sensor_type in link_buffers[link]:
+        return link_buffers[link][sensor_type]
+    return link_derived[link].buffers[sensor_type]
+
+def latest_reading(sensor_type, seen, source=None):
+    # Returns (latest row, sequence number), or (None, None) if the widget
+    # already shows the newest reading of this sensor. The sequence number is
+    # [source, readings so far]; with ALL_LINKS the newest row of any link wins.
+    source = source or DEFAULT_LINK
+    links = source_links(source)
+    seq = [source, sum(reading_buffer(link, sensor_type).total for link in links)]
+    if seq == seen:
+        return None, None
+    rows = [reading_buffer(link, sensor_type).snapshot(1)[0] for link in links]
+    rows = [row[:, 0] for row in rows if row.shape[1]]
+    latest = max(rows, key=lambda row: row[0]) if rows else None
+    return latest, seq
+
+def live_archive(link):
+    # The flight archive the readings of `link` are being saved to, if any:
+    # the spilled one, which gets every reading, else the Save Data one.
+    # Callers only use it for what is older than the buffers when it reaches
+    # that far (FlightArchive.reaches).
+    for writer in (spills.get(link), writers.get(link)):
+        for sink in writer.sinks if writer is not None else ():
+            if isinstance(sink, ArchiveSink) and sink.archive is not None:
+                return sink.archive
+    if INGEST_MODE == 'shared' and SPILL:
+        # spilled by ingest.py, into a new session every time it starts
+        directory = os.path.join(SPILL_DIR, link)
+        sessions = sorted(
+            session for session in (os.listdir(directory) if os.path.isdir(directory) else [])
+            if os.path.exists(os.path.join(directory, session, META_FILE))
+        )
+        if sessions:
+            return flight_archive(os.path.join(directory, sessions[-1]))
+    return None
+
+def chart_data(sensor_type, cursor, source, start=None, end=None):
+    source = source or DEFAULT_LINK
+    if cursor is not None and cursor.get('source') != source:
+        cursor = None
+    window = CHART_MAX_POINTS if CHART_DOWNSAMPLE else CHART_WINDOW
+    if source == ALL_LINKS:
+        data, cursor = overlay_update(
+            [link_buffers[link][sensor_type] for link in LINKS], list(LINKS), cursor, window,
+            [link_pyramids[link][sensor_type] for link in LINKS] if CHART_DOWNSAMPLE else None,
+            start, end, [live_archive(link) for link in LINKS], sensor_type
+        )
+    else:
+        data, cursor = chart_update(
+            link_buffers[source][sensor_type], sensor_type, cursor, window, CHART_DELTA_UPDATES,
+            link_pyramids[source].get(sensor_type), start, end, live_archive(source)
+        )
+    if cursor is not no_update:
+        cursor['source'] = source
+    return data, cursor
+
+
 @app.callback(
-    [
-        Output('temp_chart', 'data'), 
-        Output('pressure_chart', 'data'),
-        Output('thermometer', 'value'),
-        Output('pressure_gauge','figure'),
-        Output('velocity_display', 'figure'),
-        Output('light_display','children' ),
-        Output('accelerometer_gauge','value'),
-        Output('gyro_x','children'),
-        Output('gyro_y','children'),
-        Output('gyro_z','children'),
-        Output('cylinder-mesh', 'state')
-    ],
-    [
-        Input('interval-component', 'n_intervals')
-    ]
+    Output('temp_chart', 'data'),
+    Output('temp_chart_cursor', 'data'),
+    Input('temp_chart_interval', 'n_intervals'),
+    State('temp_chart_cursor', 'data'),
+    State('link_picker', 'value'),
+    State('chart_start', 'value'),
+    State('chart_end', 'value')
+)
+@timed_callback('temp_chart')
+def update_temp_chart(n, cursor, source=None, start=None, end=None):
+    return chart_data('temperature', cursor, source, start, end)
+
+
+@app.callback(
+    Output('pressure_chart', 'data'),
+    Output('pressure_chart_cursor', 'data'),
+    Input('pressure_chart_interval', 'n_intervals'),
+    State('pressure_chart_cursor', 'data'),
+    State('link_picker', 'value'),
+    State('chart_start', 'value'),
+    State('chart_end', 'value')
 )
+@timed_callback('pressure_chart')
+def update_pressure_chart(n, cursor, source=None, start=None, end=None):
+    return chart_data('pressure', cursor, source, start, end)
+
 
-def update_graphs(n):
-    global angle_x, angle_y, angle_z
-    
-    transformation = vtk.vtkTransformPolyDataFilter()
-    transform = vtk.vtkTransform()
-    transform.RotateX(angle_y)
-    transform.RotateY(angle_x)
-    transform.RotateZ(angle_z)
+@app.callback(
+    Output('temp_chart', 'series'),
+    Output('temp_chart', 'type'),
+    Output('pressure_chart', 'series'),
+    Input('link_picker', 'value')
+)
+def update_chart_series(source):
+    if source == ALL_LINKS:
+        # one unstacked series per link
+        series = [{"name": link, "color": LINK_COLORS[i % len(LINK_COLORS)]} for i, link in enumerate(LINKS)]
+        return series, "default", series
+    return [{"name": "temperature", "color": "orange.7"}], "stacked", [{"name": "pressure", "color": "pink.7"}]
+
+
+@app.callback(
+    Output('thermometer', 'value'),
+    Output('thermometer_seq', 'data'),
+    Input('thermometer_interval', 'n_intervals'),
+    State('thermometer_seq', 'data'),
+    State('link_picker', 'value')
+)
+@timed_callback('thermometer')
+def update_thermometer(n, seen, source=None):
+    latest, seq = latest_reading('temperature', seen, source)
+    if seq is None:
+        return no_update, no_update
+    if latest is None:
+        return 0, seq
+    return float(latest[1]), seq
+
+
+@app.callback(
+    Output('pressure_gauge', 'figure'),
+    Output('pressure_gauge_seq', 'data'),
+    Input('pressure_gauge_interval', 'n_intervals'),
+    State('pressure_gauge_seq', 'data'),
+    State('link_picker', 'value')
+)
+@timed_callback('pressure_gauge')
+def update_pressure_gauge(n, seen, source=None):
+    latest, seq = latest_reading('pressure', seen, source)
+    if seq is None:
+        return no_update, no_update
+    if latest is None:
+        return no_update, seq
+
+    latest_pressure = float(latest[1])
+    return pressure_gauge_patch(latest_pressure), seq
+
+
+@app.callback(
+    Output('velocity_display', 'figure'),
+    Output('velocity_display_seq', 'data'),
+    Input('velocity_display_interval', 'n_intervals'),
+    State('velocity_display_seq', 'data'),
+    State('link_picker', 'value')
+)
+@timed_callback('velocity_display')
+def update_velocity_display(n, seen, source=None):
+    latest, seq = latest_reading('velocity', seen, source)
+    if seq is None:
+        return no_update, no_update
+    if latest is None:
+        return no_update, seq
+
+    latest_velocity = float(latest[1])
+    return velocity_patch(latest_velocity), seq
+
+
+@app.callback(
+    Output('light_display', 'children'),
+    Output('light_display_seq', 'data'),
+    Input('light_display_interval', 'n_intervals'),
+    State('light_display_seq', 'data'),
+    State('link_picker', 'value')
+)
+@timed_callback('light_display')
+def update_light_display(n, seen, source=None):
+    latest, seq = latest_reading('light', seen, source)
+    if seq is None:
+        return no_update, no_update
+    if latest is None:
+        return 0, seq
+    return float(latest[1]), seq
+
+
+@app.callback(
+    Output('accelerometer_gauge', 'value'),
+    Output('accelerometer_gauge_seq', 'data'),
+    Input('accelerometer_gauge_interval', 'n_intervals'),
+    State('accelerometer_gauge_seq', 'data'),
+    State('link_picker', 'value')
+)
+@timed_callback('accelerometer_gauge')
+def update_accelerometer_gauge(n, seen, source=None):
+    latest, seq = latest_reading('accelerometer', seen, source)
+    if seq is None:
+        return no_update, no_update
+    if latest is None:
+        return 0, seq
+    return float(latest[1]), seq
+
+
+@app.callback(
+    Output('gyro_x', 'children'),
+    Output('gyro_y', 'children'),
+    Output('gyro_z', 'children'),
+    Output('gyro_seq', 'data'),
+    Input('gyro_interval', 'n_intervals'),
+    State('gyro_seq', 'data'),
+    State('link_picker', 'value')
+)
+@timed_callback('gyro')
+def update_gyro(n, seen, source=None):
+    latest, seq = latest_reading('gyroscope', seen, source)
+    if seq is None:
+        return no_update, no_update, no_update, no_update
+    if latest is None:
+        return "", "", "", seq
+    _, yaw, pitch, roll = latest.tolist()
+    return f"{yaw:.2f}", f"{pitch:.2f}", f"{roll:.2f}", seq
+
+
+@app.callback(
+    Output('altitude_display', 'children'),
+    Output('descent_rate_display', 'children'),
+    Output('altitude_display_seq', 'data'),
+    Input('altitude_display_interval', 'n_intervals'),
+    State('altitude_display_seq', 'data'),
+    State('link_picker', 'value')
+)
+@timed_callback('altitude_display')
+def update_altitude_display(n, seen, source=None):
+    latest, seq = latest_reading('altitude', seen, source)
+    if seq is None:
+        return no_update, no_update, no_update
+    if latest is None:
+        return "", "", seq
+    _, altitude, _, _, descent_rate = latest.tolist()
+    return f"{altitude:.1f} m", f"{descent_rate:.1f} m/s descent", seq
+
+
+@lru_cache(maxsize=4096)
+def can_mesh_state(yaw, pitch, roll):
+    from dash_vtk.utils import to_mesh_state
+    from vtkmodules.vtkCommonTransforms import vtkTransform
+    from vtkmodules.vtkFiltersGeneral import vtkTransformPolyDataFilter
+    transformation = vtkTransformPolyDataFilter()
+    transform = vtkTransform()
+    transform.RotateX(pitch)
+    transform.RotateY(yaw)
+    transform.RotateZ(roll)
 
     transformation.SetTransform(transform)
-    transformation.SetInputData(poly_data)
+    transformation.SetInputData(can_poly_data())
     transformation.Update()
 
-    new_poly_data = transformation.GetOutput()
-    new_mesh_state = to_mesh_state(new_poly_data)
-    
-    temp_chart_data = []
-    pressure_chart_data = []
-
-    thermometer_value = 0 
-    acceleration_value = 0
-    latest_velocity = 0
-    latest_light = 0
-    
-    yaw_value = ""
-    pitch_value = ""
-    roll_value = ""
-    
-          
-    gauge_pressure_fig = go.Figure()  
-    velocity_display_fig = go.Figure()
-
-    with data_lock:
-        if not data.empty:
-            
-            try:
-            # temperature data filtering
-                temperature_data = data[data['sensor_type'] == 'temperature'].copy()
-                if not temperature_data.empty:
-                    temperature_data = temperature_data.astype({'value': float, 'time': float})
-                    temp_chart_data = temperature_data[['time', 'value']].rename(columns={'value': 'temperature'}).to_dict('records')
-
-                    #thermometer value
-                    thermometer_value = temperature_data['value'].iloc[-1]
-                    
-            except ValueError as e:
-                    print(f"Error processing temperature data: {e}")
-  
-            #pressure data filtering
-            try:
-                pressure_data = data[data['sensor_type'] == 'pressure'].copy()
-                if not pressure_data.empty:
-                    pressure_data = pressure_data.astype({'value': float, 'time': float})
-                    pressure_chart_data = pressure_data[['time', 'value']].rename(columns={'value': 'pressure'}).to_dict('records')
-                    
-                    latest_pressure = pressure_data.iloc[-1]['value']
-                    
-                    #gauge for pressure
-                    gauge_pressure_fig = go.Figure(go.Indicator(
-                        mode="gauge+number",
-                        value=latest_pressure,
-                        gauge={
-                            'axis': {'range': [None, 100], 'tickcolor': 'white'},
-                            'bar': {'color': '#d8eaff'},
-                            'steps': [
-                                {'range': [0, 50], 'color': '#2e547f'},
-                                {'range': [50, 100], 'color': '#61c3df'},
-                            ]
-                        }
-                    ))
-                    
-                    gauge_pressure_fig.update_layout(
-                        paper_bgcolor='#0f1d39', 
-                        font_color='white', 
-                        margin=dict(l=30, r=40, t=0, b=10)
-                    )
-                    
-            except ValueError as e:
-                    print(f"Error processing pressure data: {e}")
-                    
-            # velocity display       
-            try:
-                velocity_data = data[data['sensor_type'] == 'velocity'].copy()
-                if not velocity_data.empty:
-
-                    latest_velocity = float(velocity_data.iloc[-1]['value']) 
-                    
-                    velocity_display_fig = go.Figure(
-                        data=[go.Pie(
-                            values=[abs(latest_velocity)/5*100, 100 - abs(latest_velocity)/5*100],
-                            hole=.6,
-                            marker=dict(colors=['#432267', '#b463b1']),
-                            textinfo='none',
-                            direction='clockwise',
-                            hoverinfo='none'
-                            )
-                        ]
-                    )
-                    
-                    velocity_display_fig.update_layout(    
-                        paper_bgcolor='#0f1d39', 
-                        font_color='white',
-                        showlegend=False,
-                        margin=dict(l=0, r=0, t=0, b=0),
-                        annotations=[
-                            dict(
-                                x=0.5,
-                                y=0.5,  
-                                text=f"{abs(latest_velocity):.1f}",
-                                font=dict(size=14, color="white"),  
-                                showarrow=False
-                            )
-                        ]
-                    )
+    with mesh_state_timer.time():
+        return to_mesh_state(transformation.GetOutput())
+
+
+if CAN3D_CLIENT_TRANSFORM:
+    # the mesh is sent once with the layout, only the angles go over the wire
+    @app.callback(
+        Output('can3d_angles', 'data'),
+        Output('can3d_seq', 'data'),
+        Input('can3d_interval', 'n_intervals'),
+        State('can3d_seq', 'data'),
+        State('link_picker', 'value')
+    )
+    @timed_callback('can3d')
+    def update_can3d(n, seen, source=None):
+        latest, seq = latest_reading(CAN3D_READING, seen, source)
+        if seq is None or latest is None:
+            return no_update, no_update
+        yaw, pitch, roll = latest[1:4].tolist()
+        return [yaw, pitch, roll], seq
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='can3d', function_name='actor'),
+        Output('can3d_representation', 'actor'),
+        Input('can3d_angles', 'data')
+    )
+
+else:
+    @app.callback(
+        Output('cylinder-mesh', 'state'),
+        Output('can3d_seq', 'data'),
+        Input('can3d_interval', 'n_intervals'),
+        State('can3d_seq', 'data'),
+        State('link_picker', 'value')
+    )
+    @timed_callback('can3d')
+    def update_can3d(n, seen, source=None):
+        latest, seq = latest_reading(CAN3D_READING, seen, source)
+        if seq is None or latest is None:
+            return no_update, no_update
+        yaw, pitch, roll = (round(angle / CAN3D_ANGLE_STEP) * CAN3D_ANGLE_STEP for angle in latest[1:4].tolist())
+        return can_mesh_state(yaw, pitch, roll), seq
+
+@app.server.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@lru_cache(maxsize=16)
+def flight_archive(path):
+    # kept open so its block summaries are only built once
+    return FlightArchive(path)
+
+# block summaries of the live buffers for /query, built on first use
+live_indexes = {}
+
+def live_index(link, sensor_type):
+    buffer = reading_buffer(link, sensor_type)
+    index = live_indexes.get((link, sensor_type))
+    if index is None or index.buffer is not buffer:
+        index = live_indexes[(link, sensor_type)] = LiveBlockIndex(buffer)
+    return index
+
+def live_aggregate(link, sensor_type, start=None, end=None):
+    # aggregate of the readings of a link; what is older than its buffer
+    # comes from the archive the readings are saved to when it reaches that
+    # far, else from the block summaries of the live index, which only keep
+    # whole blocks of overwritten rows ('partial' in the result)
+    index = live_index(link, sensor_type)
+    archive = live_archive(link)
+    parts = []
+    _, split, _ = index.buffer.span()
+    older = not index.buffer.reaches(start)
+    if older and archive is not None and sensor_type in archive.sensors and archive.reaches(sensor_type, start, split):
+        parts.append(archive.summary(sensor_type, start, math.nextafter(split, -math.inf) if end is None or end >= split else end))
+        start = split
+        older = False
+    if end is None or start is None or end >= start:
+        parts.append(index.summary(start, end))
+    result = aggregate_result(combine(parts), index.buffer.columns)
+    if older:
+        result['partial'] = True
+    return result
+
+@app.server.route('/query')
+def query():
+    # Aggregates of one sensor over a time range, e.g.
+    # /query?sensor=pressure&start=120&end=180 for the live buffers of a link
+    # (&link=..., the default link otherwise) or of a saved flight (&archive=<session>,
+    # relative to ARCHIVE_DIR, so spill/<link>/<session> for the spilled full-resolution history).
+    # Live results with 'partial' set missed readings older than the buffers (see live_aggregate).
+    sensor = request.args.get('sensor', '')
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    session = request.args.get('archive')
+    link = request.args.get('link', DEFAULT_LINK)
+    try:
+        if session:
+            if os.path.isabs(session) or os.path.normpath(session).split(os.sep)[0] == os.pardir:
+                raise KeyError(session)
+            result = flight_archive(os.path.join(ARCHIVE_DIR, session)).aggregate(sensor, start, end)
+        else:
+            result = live_aggregate(link, sensor, start, end)
+    except (KeyError, FileNotFoundError):
+        return Response(json.dumps({'error': f"no {sensor!r} data for {session or link!r}"}), status=404, mimetype='application/json')
+    return Response(json.dumps(result), mimetype='application/json')
+
+if DIAGNOSTICS_PANEL:
+    @app.callback(
+        Output('diagnostics', 'children'),
+        Input('diagnostics_interval', 'n_intervals')
+    )
+    def update_diagnostics(n):
+        return '\n'.join(REGISTRY.summary())
+
+if TRANSPORT == 'sse':
+    @app.server.route('/stream')
+    def stream():
+        return Response(
+            stream_with_context(broadcaster.events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
 
-            except ValueError as e:
-                    print(f"Error processing velocity data: {e}")
-            
-            
-            # light display       
-            try:
-                light_data = data[data['sensor_type'] == 'light'].copy()
-                if not light_data.empty:
-                    latest_light = float(light_data.iloc[-1]['value'])                 
-                    
-            except ValueError as e:
-                    print(f"Error processing light data: {e}")
-                    
-            # accelerometer display       
-            try:
-                accelerometer_data = data[data['sensor_type'] == 'accelerometer'].copy()
-                if not accelerometer_data.empty:
-                    
-                    acceleration_value = float(accelerometer_data.iloc[-1]['value'])
-                    
-            except ValueError as e:
-                    print(f"Error processing accelerometer data: {e}")  
-            
-            
-            # gyroscope display       
-            try:
-                gyro_data = data[data['sensor_type'] == 'gyroscope'].copy()
-                if not gyro_data.empty:
-                    
-                    gyro_data[['yaw', 'pitch', 'roll']] = gyro_data['value'].str.split(',', expand=True)
-                    gyro_data = gyro_data.drop(columns=['value'])
-                    gyro_data = gyro_data.astype({'yaw': float, 'pitch': float, 'roll': float})
-                    latest_gyro = gyro_data.iloc[-1]
-                    yaw_value = f"{latest_gyro['yaw']:.2f}"
-                    pitch_value = f"{latest_gyro['pitch']:.2f}"
-                    roll_value = f"{latest_gyro['roll']:.2f}"
-                    
-                    angle_x = float(latest_gyro["yaw"])
-                    angle_y = float(latest_gyro["pitch"])
-                    angle_z = float(latest_gyro["roll"])
-                    
-
-            except ValueError as e:
-                    print(f"Error processing gyro data: {e}")
-                    
-                    
-                
-    return [temp_chart_data, pressure_chart_data, thermometer_value, gauge_pressure_fig, velocity_display_fig, latest_light, acceleration_value, yaw_value, pitch_value, roll_value, new_mesh_state] 
+    app.clientside_callback(
+        ClientsideFunction(namespace='stream', function_name='connect'),
+        Output('stream_status', 'data'),
+        Input('stream_config', 'data')
+    )
 
 if __name__ == '__main__':
+    start_ingest()
     app.run_server(debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,184 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from buffers import SENSOR_COLUMNS
+from downsample import archive_points, bucket_points, reading_buckets
+from query import BlockIndex, aggregate_result, range_bounds, summarize
+
+ARCHIVE_DTYPE = np.dtype('<f8')
+META_FILE = 'meta.json'
+
+
+# A flight archive is a directory holding, for each sensor, a raw
+# little-endian float64 file of rows (time first, then the sensor's values,
+# see SENSOR_COLUMNS) plus a meta.json describing the columns. Files are
+# append-only and opened with np.memmap, so even multi-hour flights open
+# instantly and a time range only touches the pages it covers. Aggregates
+# over a time range use block summaries built on first use (query.BlockIndex).
+
+
+class FlightArchive:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self._indexes = {}
+
+    @classmethod
+    def create(cls, directory='flights', session=None):
+        if session is None:
+            session = started = datetime.now().strftime('%Y%m%d-%H%M%S')
+            # a restart within the same second still gets a session of its own
+            attempt = 1
+            while os.path.exists(os.path.join(directory, session)):
+                attempt += 1
+                session = f'{started}-{attempt}'
+        path = os.path.join(directory, session)
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            meta = {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'sensors': {
+                    sensor: {'columns': list(columns), 'sorted': True}
+                    for sensor, columns in SENSOR_COLUMNS.items()
+                },
+            }
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f, indent=2)
+        return cls(path)
+
+    @property
+    def sensors(self):
+        return list(self.meta['sensors'])
+
+    def columns(self, sensor):
+        return self.meta['sensors'][sensor]['columns']
+
+    def _file(self, sensor):
+        return os.path.join(self.path, f'{sensor}.f64')
+
+    def rows(self, sensor, start=None, end=None):
+        # Read-only memory-mapped (n, columns) rows with start <= time <= end.
+        width = len(self.columns(sensor))
+        filename = self._file(sensor)
+        # a crash can leave a partial row at the end, it is ignored
+        count = os.path.getsize(filename) // (ARCHIVE_DTYPE.itemsize * width) if os.path.exists(filename) else 0
+        if count == 0:
+            return np.empty((0, width), dtype=ARCHIVE_DTYPE)
+        rows = np.memmap(filename, dtype=ARCHIVE_DTYPE, mode='r', shape=(count, width))
+        if start is None and end is None:
+            return rows
+        times = rows[:, 0]
+        if not self.meta['sensors'][sensor]['sorted']:
+            mask = np.ones(count, dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times <= end
+            return rows[mask]
+        first, last = range_bounds(times, start, end)
+        return rows[first:last]
+
+    def reaches(self, sensor, start=None, until=None):
+        # whether the rows of `sensor` go back to `start` and on to `until`,
+        # so they can stand in for readings a buffer from `until` on lost
+        rows = self.rows(sensor)
+        if not len(rows):
+            return False
+        times = rows[:, 0]
+        if self.meta['sensors'][sensor]['sorted']:
+            first, last = times[0], times[-1]
+        else:
+            first, last = times.min(), times.max()
+        return (start is None or first <= start) and (until is None or last >= until)
+
+    def _index(self, sensor):
+        # dict.setdefault, so threads racing to build it end up with the same one
+        return self._indexes.get(sensor) or self._indexes.setdefault(sensor, BlockIndex(self.columns(sensor)))
+
+    def summary(self, sensor, start=None, end=None):
+        # query.summarize() layout summary of start <= time <= end, None when empty
+        if not self.meta['sensors'][sensor]['sorted']:
+            rows = np.asarray(self.rows(sensor, start, end))
+            return summarize(rows[np.argsort(rows[:, 0], kind='stable')]) if len(rows) else None
+        return self._index(sensor).summary(self.rows(sensor), start, end)
+
+    def aggregate(self, sensor, start=None, end=None):
+        # count, min, max, sum and mean of each value column with start <= time <= end
+        return aggregate_result(self.summary(sensor, start, end), self.columns(sensor))
+
+    def points(self, sensor, field, start=None, end=None, max_points=500):
+        # (2, k) time-ordered points of value column `field` (1 for the first
+        # value) with start <= time <= end, min/max downsampled to at most
+        # about max_points
+        if not self.meta['sensors'][sensor]['sorted']:
+            rows = np.asarray(self.rows(sensor, start, end))
+            rows = rows[np.argsort(rows[:, 0], kind='stable')]
+            if len(rows) <= max_points:
+                return rows[:, [0, field]].T
+            return bucket_points(reading_buckets(rows[:, 0], rows[:, field]), max_points)
+        return archive_points(self._index(sensor), self.rows(sensor), field, start, end, max_points)
+
+    def chunks(self, sensor, chunk_rows=65536, start=None, end=None):
+        rows = self.rows(sensor, start, end)
+        for first in range(0, len(rows), chunk_rows):
+            yield rows[first:first + chunk_rows]
+
+    def frame(self, sensor, start=None, end=None):
+        import pandas as pd
+        return pd.DataFrame(np.asarray(self.rows(sensor, start, end)), columns=self.columns(sensor))
+
+    def append(self, sensor, rows):
+        # rows: (n, columns) array-like
+        rows = np.ascontiguousarray(rows, dtype=ARCHIVE_DTYPE)
+        if not len(rows):
+            return
+        if rows.ndim != 2 or rows.shape[1] != len(self.columns(sensor)):
+            raise ValueError(f"expected rows of {len(self.columns(sensor))} columns for {sensor}, got shape {rows.shape}")
+        info = self.meta['sensors'][sensor]
+        last = self._last_time(sensor)
+        if info['sorted'] and (np.any(np.diff(rows[:, 0]) < 0) or (last is not None and rows[0, 0] < last)):
+            info['sorted'] = False
+            with open(os.path.join(self.path, META_FILE), 'w') as f:
+                json.dump(self.meta, f, indent=2)
+        with open(self._file(sensor), 'ab') as f:
+            f.write(rows.tobytes())
+
+    def _last_time(self, sensor):
+        rows = self.rows(sensor)
+        return float(rows[-1, 0]) if len(rows) else None
+
+
+class ArchiveSink:
+    # BackgroundWriter sink that appends to a FlightArchive. The session
+    # directory is only created once there is something to write.
+
+    def __init__(self, directory='flights'):
+        self.directory = directory
+        self.archive = None
+
+    def write(self, sensor_type, view):
+        if self.archive is None:
+            self.archive = FlightArchive.create(self.directory)
+        self.archive.append(sensor_type, view.T)
+
+
+def import_csv(directory='.', archive_directory='flights', session=None):
+    # Converts the {sensor}_data.csv files written by CsvSink into an archive,
+    # splitting gyroscope "yaw,pitch,roll" strings into three float columns.
+    import pandas as pd
+    archive = FlightArchive.create(archive_directory, session)
+    for sensor in SENSOR_COLUMNS:
+        filename = os.path.join(directory, f'{sensor}_data.csv')
+        if not os.path.exists(filename):
+            continue
+        for chunk in pd.read_csv(filename, chunksize=65536, dtype={'value': str}):
+            values = chunk['value'].str.split(',', expand=True).astype(float)
+            rows = np.column_stack([chunk['time'].astype(float), values])
+            archive.append(sensor, rows)
+    return archive
@@ -0,0 +1,88 @@
+// Rotates the 3D can on the client from [yaw, pitch, roll] in degrees, so
+// the server only sends three numbers instead of a new mesh every tick.
+(function () {
+    var DEG = Math.PI / 180;
+
+    function multiply(a, b) {
+        var out = [[0, 0, 0], [0, 0, 0], [0, 0, 0]];
+        for (var i = 0; i < 3; i++) {
+            for (var j = 0; j < 3; j++) {
+                out[i][j] = a[i][0] * b[0][j] + a[i][1] * b[1][j] + a[i][2] * b[2][j];
+            }
+        }
+        return out;
+    }
+
+    function rotateX(deg) {
+        var c = Math.cos(deg * DEG), s = Math.sin(deg * DEG);
+        return [[1, 0, 0], [0, c, -s], [0, s, c]];
+    }
+
+    function rotateY(deg) {
+        var c = Math.cos(deg * DEG), s = Math.sin(deg * DEG);
+        return [[c, 0, s], [0, 1, 0], [-s, 0, c]];
+    }
+
+    function rotateZ(deg) {
+        var c = Math.cos(deg * DEG), s = Math.sin(deg * DEG);
+        return [[c, -s, 0], [s, c, 0], [0, 0, 1]];
+    }
+
+    // Same decomposition as vtkTransform::GetOrientation: the returned
+    // [x, y, z] rebuild the matrix when applied as rotateZ, rotateX, rotateY,
+    // which is what vtk.js actor.setOrientation does.
+    function orientation(m) {
+        var x2 = m[2][0], y2 = m[2][1], z2 = m[2][2];
+        var x3 = m[1][0], y3 = m[1][1], z3 = m[1][2];
+        var eps = 1e-9;
+
+        var d1 = Math.sqrt(x2 * x2 + z2 * z2);
+        var cosTheta = 1, sinTheta = 0;
+        if (d1 >= eps) {
+            cosTheta = z2 / d1;
+            sinTheta = x2 / d1;
+        }
+        var theta = Math.atan2(sinTheta, cosTheta);
+
+        var d = Math.sqrt(x2 * x2 + y2 * y2 + z2 * z2);
+        var sinPhi = 0, cosPhi = 1;
+        if (d >= eps) {
+            sinPhi = y2 / d;
+            cosPhi = d1 >= eps ? (x2 * x2 + z2 * z2) / (d1 * d) : z2 / d;
+        }
+        var phi = Math.atan2(sinPhi, cosPhi);
+
+        var x3p = x3 * cosTheta - z3 * sinTheta;
+        var y3p = -sinPhi * sinTheta * x3 + cosPhi * y3 - sinPhi * cosTheta * z3;
+        var d2 = Math.sqrt(x3p * x3p + y3p * y3p);
+        var cosAlpha = 1, sinAlpha = 0;
+        if (d2 >= eps) {
+            cosAlpha = y3p / d2;
+            sinAlpha = x3p / d2;
+        }
+        var alpha = Math.atan2(sinAlpha, cosAlpha);
+
+        return [phi / DEG, -theta / DEG, alpha / DEG];
+    }
+
+    function canOrientation(yaw, pitch, roll) {
+        // matches the server-side transform: RotateX(pitch), RotateY(yaw), RotateZ(roll)
+        return orientation(multiply(multiply(rotateX(pitch), rotateY(yaw)), rotateZ(roll)));
+    }
+
+    if (typeof window !== 'undefined') {
+        window.dash_clientside = Object.assign({}, window.dash_clientside, {
+            can3d: {
+                actor: function (angles) {
+                    if (!angles) {
+                        return window.dash_clientside.no_update;
+                    }
+                    return {orientation: canOrientation(angles[0], angles[1], angles[2])};
+                }
+            }
+        });
+    }
+    if (typeof module !== 'undefined') {
+        module.exports = {canOrientation: canOrientation};
+    }
+})();
@@ -0,0 +1,91 @@
+// Server-Sent Events client. Used instead of the dcc.Interval polling when
+// the server runs with SATDASH_TRANSPORT=sse: every event carries the new
+// rows per sensor and is applied straight to the components with set_props.
+(function () {
+    var source = null;
+    var totals = {};
+    var charts = {
+        temperature: {id: 'temp_chart', series: 'temperature', points: []},
+        pressure: {id: 'pressure_chart', series: 'pressure', points: []}
+    };
+
+    function copy(value) {
+        return JSON.parse(JSON.stringify(value));
+    }
+
+    function update(config, sensor, rows) {
+        var set_props = window.dash_clientside.set_props;
+        var latest = rows[rows.length - 1];
+        var chart = charts[sensor];
+        if (chart) {
+            rows.forEach(function (row) {
+                var point = {time: row[0]};
+                point[chart.series] = row[1];
+                chart.points.push(point);
+            });
+            if (chart.points.length > config.window) {
+                chart.points.splice(0, chart.points.length - config.window);
+            }
+            set_props(chart.id, {data: chart.points.slice()});
+        }
+
+        if (sensor === 'temperature') {
+            set_props('thermometer', {value: latest[1]});
+        } else if (sensor === 'pressure') {
+            var gauge = copy(config.figures.pressure_gauge);
+            gauge.data[0].value = latest[1];
+            set_props('pressure_gauge', {figure: gauge});
+        } else if (sensor === 'velocity') {
+            var speed = Math.abs(latest[1]);
+            var donut = copy(config.figures.velocity_display);
+            donut.data[0].values = [speed / 5 * 100, 100 - speed / 5 * 100];
+            donut.layout.annotations[0].text = speed.toFixed(1);
+            set_props('velocity_display', {figure: donut});
+        } else if (sensor === 'light') {
+            set_props('light_display', {children: latest[1]});
+        } else if (sensor === 'accelerometer') {
+            set_props('accelerometer_gauge', {value: latest[1]});
+        } else if (sensor === 'gyroscope') {
+            set_props('gyro_x', {children: latest[1].toFixed(2)});
+            set_props('gyro_y', {children: latest[2].toFixed(2)});
+            set_props('gyro_z', {children: latest[3].toFixed(2)});
+            if (config.can3d_client) {
+                set_props('can3d_representation', {actor: window.dash_clientside.can3d.actor(latest.slice(1))});
+            }
+        }
+    }
+
+    function apply(config, event) {
+        if (event.reset) {
+            totals = {};
+            Object.keys(charts).forEach(function (sensor) {
+                charts[sensor].points = [];
+            });
+        }
+        Object.keys(event.sensors).forEach(function (sensor) {
+            var entry = event.sensors[sensor];
+            var known = totals[sensor] || 0;
+            // rows already received through an earlier snapshot are skipped
+            var rows = entry.rows.slice(Math.max(0, entry.rows.length - (entry.total - known)));
+            totals[sensor] = Math.max(known, entry.total);
+            if (rows.length) {
+                update(config, sensor, rows);
+            }
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        stream: {
+            connect: function (config) {
+                if (!config || source) {
+                    return window.dash_clientside.no_update;
+                }
+                source = new EventSource(config.url);
+                source.onmessage = function (message) {
+                    apply(config, JSON.parse(message.data));
+                };
+                return config.url;
+            }
+        }
+    });
+})();
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Benchmarks the ingest -> callback pipeline without hardware.
+#
+#   python benchmarks/bench_pipeline.py --out results.json
+#   python benchmarks/bench_pipeline.py --quick --compare results.json
+#
+# Ingest: synthetic telemetry is fed at rising rates into the app's reader
+# loop, reporting packets/s actually ingested.
+# Callbacks: the buffers are filled with 1k, 100k and 1M rows and every
+# widget callback is timed (p50/p99) with the size of its JSON response.
+# Startup: seconds to import app.py in a fresh interpreter, against
+# STARTUP_TARGET_SECONDS.
+# Results are written as JSON so runs of different versions can be compared.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('SATDASH_SOURCE', 'none')
+# importing the app must not take longer than this
+STARTUP_TARGET_SECONDS = 2.0
+
+import plotly.utils  # noqa: E402
+
+import app  # noqa: E402
+from buffers import make_sensor_buffers  # noqa: E402
+from sources import SyntheticSource  # noqa: E402
+
+
+def percentiles(samples, scale=1e6):
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples) * scale
+    return {
+        'count': len(values),
+        'p50': float(np.percentile(values, 50)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+        'mean': float(values.mean()),
+    }
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_buffers(capacity):
+    app.buffers.update(make_sensor_buffers(capacity))
+    app.pyramids.clear()
+    app.pyramids.update(app.make_chart_pyramids(app.buffers))
+    app.link_derived[app.DEFAULT_LINK] = app.derived_metrics(app.buffers)
+
+
+def update_pyramids():
+    for pyramid in app.pyramids.values():
+        pyramid.update()
+    for sensor in ('pressure', 'gyroscope'):
+        app.link_derived[app.DEFAULT_LINK].update(sensor)
+
+
+def ingested():
+    return sum(buffer.total for buffer in app.buffers.values())
+
+
+def bench_ingest(protocol, rate, duration):
+    count = int(rate * duration) if rate else 200_000
+    reset_buffers(max(count, 1))
+    source = SyntheticSource(rate, protocol, count=count)
+    reader = app.read_binary if protocol == 'binary' else app.read_text
+    threading.Thread(target=reader, args=(source,), daemon=True).start()
+
+    started = time.perf_counter()
+    source.start()
+    deadline = started + (duration * 3 + 10 if rate else 120)
+    while ingested() < count and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    source.close()
+
+    done = ingested()
+    return {
+        'protocol': protocol,
+        'offered_rate': rate,
+        'packets': done,
+        'seconds': elapsed,
+        'packets_per_second': done / elapsed,
+        'kept_up': done >= count and (rate is None or done / elapsed >= 0.95 * rate),
+    }
+
+
+def fill(rows):
+    times = np.arange(rows, dtype=np.float64) * 0.01
+    for sensor, buffer in app.buffers.items():
+        values = [np.sin(times + i) * 10 + 50 for i in range(len(buffer.columns) - 1)]
+        buffer.extend(np.column_stack([times] + values))
+    update_pyramids()
+
+
+def append_rows(count=1):
+    for buffer in app.buffers.values():
+        latest = buffer.latest()
+        for i in range(count):
+            row = latest.copy()
+            row[0] += 0.01 * (i + 1)
+            buffer.append(row)
+    update_pyramids()
+
+
+def payload_bytes(outputs):
+    return len(json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def time_callback(call, iterations, rows_per_tick=1):
+    latencies = []
+    sizes = []
+    for _ in range(iterations):
+        append_rows(rows_per_tick)
+        started = time.perf_counter()
+        outputs = call()
+        latencies.append(time.perf_counter() - started)
+        sizes.append(payload_bytes(outputs))
+    result = percentiles(latencies)
+    result['payload_bytes'] = int(np.median(sizes))
+    return result
+
+
+def bench_callbacks(rows, iterations):
+    reset_buffers(rows + iterations * 4 + 16)
+    fill(rows)
+
+    cursor = {}
+
+    def chart_tick():
+        outputs = app.update_temp_chart(0, cursor.get('temp'))
+        if outputs[1] is not app.no_update:
+            cursor['temp'] = outputs[1]
+        return outputs
+
+    callbacks = {
+        'temp_chart_first_load': lambda: app.update_temp_chart(0, None),
+        'temp_chart_tick': chart_tick,
+        'thermometer': lambda: app.update_thermometer(0, None),
+        'pressure_gauge': lambda: app.update_pressure_gauge(0, None),
+        'velocity_display': lambda: app.update_velocity_display(0, None),
+        'light_display': lambda: app.update_light_display(0, None),
+        'accelerometer_gauge': lambda: app.update_accelerometer_gauge(0, None),
+        'gyro': lambda: app.update_gyro(0, None),
+        'can3d': lambda: app.update_can3d(0, None),
+        'altitude_display': lambda: app.update_altitude_display(0, None),
+    }
+    results = {}
+    for name, call in callbacks.items():
+        runs = iterations if name != 'temp_chart_first_load' else max(iterations // 10, 5)
+        results[name] = time_callback(call, runs, rows_per_tick=3 if name == 'temp_chart_tick' else 1)
+    return {
+        'history_rows': rows,
+        'callbacks': results,
+        'snapshot_retries': sum(buffer.retries for buffer in app.buffers.values()),
+        'rss_bytes': rss_bytes(),
+    }
+
+
+def bench_startup(runs):
+    # the first run also builds the cached can mesh if it is missing
+    script = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+    seconds = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True)
+        seconds.append(float(output.stdout.strip().splitlines()[-1]))
+    return {
+        'first_seconds': seconds[0],
+        'median_seconds': float(np.median(seconds[1:] or seconds)),
+        'target_seconds': STARTUP_TARGET_SECONDS,
+        'meets_target': float(np.median(seconds[1:] or seconds)) <= STARTUP_TARGET_SECONDS,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(flatten(item, f'{prefix}{key}.'))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for i, item in enumerate(value):
+            items.update(flatten(item, f'{prefix}{i}.'))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+
+def compare(baseline, results):
+    old = flatten({k: baseline[k] for k in ('ingest', 'callbacks', 'startup') if k in baseline})
+    new = flatten({k: results[k] for k in ('ingest', 'callbacks', 'startup') if k in results})
+    for key in sorted(old.keys() & new.keys()):
+        if old[key]:
+            change = (new[key] - old[key]) / old[key] * 100
+            print(f"{key:80s} {old[key]:14.2f} -> {new[key]:14.2f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SatDash ingest and callback pipeline.")
+    parser.add_argument('--quick', action='store_true', help="smaller rates, histories and iteration counts")
+    parser.add_argument('--duration', type=float, default=2.0, help="seconds per ingest rate")
+    parser.add_argument('--out', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--compare', help="previous JSON results to print changes against")
+    args = parser.parse_args()
+
+    rates = [1_000, 10_000, None] if args.quick else [1_000, 5_000, 10_000, 50_000, None]
+    histories = [1_000, 100_000] if args.quick else [1_000, 100_000, 1_000_000]
+    iterations = 50 if args.quick else 200
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'chart_window': app.CHART_WINDOW,
+            'chart_max_points': app.CHART_MAX_POINTS if app.CHART_DOWNSAMPLE else None,
+            'can3d_client_transform': app.CAN3D_CLIENT_TRANSFORM,
+        },
+        'ingest': [bench_ingest(protocol, rate, args.duration) for protocol in ('text', 'binary') for rate in rates],
+        'callbacks': [bench_callbacks(rows, iterations) for rows in histories],
+        'startup': bench_startup(3 if args.quick else 7),
+    }
+    results['meta']['peak_rss_bytes'] = peak_rss_bytes()
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
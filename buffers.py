@@ -0,0 +1,180 @@
+import time
+
+import numpy as np
+
+from query import range_bounds
+from schema import SENSOR_SCHEMAS
+
+DEFAULT_CAPACITY = 100_000
+# seconds a snapshot waits for a write in progress to finish. A writer
+# process that died mid-write (see shared.py) leaves the sequence odd for good.
+SNAPSHOT_TIMEOUT = 0.5
+
+# Column layout of every sensor buffer. Time is always the first column.
+SENSOR_COLUMNS = {sensor: schema.columns for sensor, schema in SENSOR_SCHEMAS.items()}
+
+
+class RingBuffer:
+    # Fixed-capacity columnar float64 buffer.
+    #
+    # Each row is written twice, at slot i and at slot i + capacity, so the
+    # most recent rows always form one contiguous slice of the storage. That
+    # keeps appends O(1) and lets readers take zero-copy views without having
+    # to unwrap the ring.
+    #
+    # One thread writes (append/extend), any number of threads read through
+    # snapshot() without a lock: the writer makes `_sequence` odd while it
+    # modifies the buffer and even again afterwards, and a reader retries its
+    # copy if the sequence changed meanwhile (a sequence lock). The writer
+    # never waits for readers. A write that does not finish within
+    # SNAPSHOT_TIMEOUT is taken for a dead writer: snapshots then return the
+    # rows as they are, at worst with one half-written row, instead of
+    # spinning. view() is only safe in the writing thread.
+
+    def __init__(self, columns, capacity=DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self._storage = np.zeros((len(self.columns), 2 * capacity), dtype=np.float64)
+        self._head = 0
+        self._size = 0
+        # number of rows ever appended, also used as a sequence number
+        self.total = 0
+        self._sequence = 0
+        # snapshots that had to be copied again because of a concurrent write
+        self.retries = 0
+        # odd sequence number a dead writer left behind
+        self._stalled = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return self._storage.nbytes
+
+    def append(self, row):
+        self._sequence += 1
+        head = self._head
+        self._storage[:, head] = row
+        self._storage[:, head + self.capacity] = row
+        self._head = (head + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        self.total += 1
+        self._sequence += 1
+
+    def extend(self, rows):
+        # rows: array-like of shape (n, len(columns))
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.columns))
+        count = len(rows)
+        if count == 0:
+            return
+        self._sequence += 1
+        kept = rows[-self.capacity:].T
+        n = kept.shape[1]
+        head = (self._head + count - n) % self.capacity
+        first = min(n, self.capacity - head)
+        self._storage[:, head:head + first] = kept[:, :first]
+        self._storage[:, head + self.capacity:head + self.capacity + first] = kept[:, :first]
+        if first < n:
+            rest = n - first
+            self._storage[:, :rest] = kept[:, first:]
+            self._storage[:, self.capacity:self.capacity + rest] = kept[:, first:]
+        self._head = (head + n) % self.capacity
+        self._size = min(self._size + count, self.capacity)
+        self.total += count
+        self._sequence += 1
+
+    def view(self, last=None):
+        # Read-only (columns, rows) view of the most recent `last` rows, oldest first.
+        size = self._size if last is None else min(last, self._size)
+        end = self._head + self.capacity
+        view = self._storage[:, end - size:end]
+        view.flags.writeable = False
+        return view
+
+    def _consistent(self, read):
+        # read() without a write in between, retried until none overlapped it
+        deadline = None
+        while True:
+            sequence = self._sequence
+            if sequence & 1 and sequence != self._stalled:
+                # a write is in progress, let the writer finish it
+                deadline = deadline or time.monotonic() + SNAPSHOT_TIMEOUT
+                if time.monotonic() < deadline:
+                    time.sleep(0)
+                    continue
+                print(f"A buffer write did not finish within {SNAPSHOT_TIMEOUT} s, reading without waiting for it")
+                self._stalled = sequence
+            result = read()
+            if self._sequence == sequence:
+                return result
+            self.retries += 1
+
+    def _slots(self, size, start=None, end=None):
+        # storage slots first..last of the latest `size` rows, limited to
+        # start <= time <= end (rows are appended in time order). Rows with a
+        # 'time_last' column (downsample.BUCKET_COLUMNS) span a time range and
+        # are included when it overlaps start..end.
+        stop = self._head + self.capacity
+        first = stop - size
+        if start is None and end is None:
+            return first, stop
+        lo = first if start is None else first + range_bounds(self._storage[self._index.get('time_last', 0), first:stop], start)[0]
+        hi = first + range_bounds(self._storage[0, first:stop], None, end)[1]
+        return lo, max(lo, hi)
+
+    def snapshot(self, last=None, since=None, start=None, end=None):
+        # Consistent (columns, rows) copy of the most recent `last` rows, of
+        # the rows appended after sequence number `since`, and/or of the rows
+        # with start <= time <= end, taken without blocking the writer.
+        # Returns (rows, total) where total is the sequence number after the
+        # last row.
+        def read():
+            total = self.total
+            size = self._size
+            if last is not None:
+                size = min(last, size)
+            if since is not None:
+                size = min(max(total - since, 0), size)
+            first, stop = self._slots(size, start, end)
+            return self._storage[:, first:stop].copy(), total
+        return self._consistent(read)
+
+    def span(self, start=None, end=None):
+        # (rows with start <= time <= end, time of the oldest row, whether
+        # older rows were overwritten) without copying any rows. The oldest
+        # time is None while the buffer is empty.
+        def read():
+            first, stop = self._slots(self._size, start, end)
+            oldest = float(self._storage[0, self._head + self.capacity - self._size]) if self._size else None
+            return stop - first, oldest, self.total > self._size
+        return self._consistent(read)
+
+    def reaches(self, start=None):
+        # whether no row from `start` on (from the first row when None) was overwritten yet
+        _, oldest, wrapped = self.span(start)
+        return not wrapped or (start is not None and oldest <= start)
+
+    def column(self, name, last=None):
+        return self.view(last)[self._index[name]]
+
+    def latest(self):
+        rows, _ = self.snapshot(1)
+        return rows[:, 0] if rows.shape[1] else None
+
+
+def merge_by_time(arrays):
+    # Time-ordered merge of (columns, n) arrays that start with a time row,
+    # such as snapshots of the same sensor from several links. Returns the
+    # merged rows and, per row, the index of the array it came from.
+    merged = np.concatenate(arrays, axis=1)
+    origin = np.repeat(np.arange(len(arrays)), [array.shape[1] for array in arrays])
+    order = np.argsort(merged[0], kind='stable')
+    return merged[:, order], origin[order]
+
+
+def make_sensor_buffers(capacity=DEFAULT_CAPACITY):
+    return {sensor: RingBuffer(columns, capacity) for sensor, columns in SENSOR_COLUMNS.items()}
@@ -0,0 +1,119 @@
+import numpy as np
+from dash import Patch, no_update
+
+from buffers import merge_by_time
+
+
+def chart_points(rows, series):
+    return [{'time': t, series: v} for t, v in zip(rows[0].tolist(), rows[1].tolist())]
+
+
+def downsampled_points(pyramid, series, max_points, start=None, end=None):
+    # (chart points, sequence number of the buffer they are up to date with)
+    (times, values), total = pyramid.query(start, end, max_points)
+    return [{'time': t, series: v} for t, v in zip(times.tolist(), values.tolist())], total
+
+
+def zoomed_rows(buffer, window, pyramid=None, start=None, end=None, archive=None, sensor=None):
+    # (2, k) time, value points of start..end, at most about `window` of them.
+    # What is older than the buffer comes from `archive` (a FlightArchive the
+    # readings of `sensor` are saved to) when it holds all of them, the rest
+    # from the pyramid, or the latest `window` rows in range without one.
+    older = None
+    _, split, _ = buffer.span()
+    if archive is not None and sensor in archive.sensors and not buffer.reaches(start) and archive.reaches(sensor, start, split):
+        recent = end is None or end >= split
+        older = archive.points(sensor, 1, start, split if recent else end, window // 2 if recent else window)
+        older = older[:, older[0] < split]
+        if not recent:
+            return older
+        start = split
+    if pyramid is not None:
+        rows, _ = pyramid.query(start, end, window // 2 if older is not None else window)
+    else:
+        rows, _ = buffer.snapshot(start=start, end=end)
+        rows = rows[:2, -window:]
+    if older is None:
+        return rows
+    # a bucket overlapping the split may have its extremes before it
+    return np.concatenate([older, rows[:, rows[0] >= start]], axis=1)
+
+
+def chart_update(buffer, series, cursor, window, delta=True, pyramid=None, start=None, end=None, archive=None):
+    # Returns (chart data, new cursor) for a dmc chart fed from `buffer`.
+    #
+    # The cursor lives in a per-tab dcc.Store and records how many rows the
+    # client has seen ('total', the buffer's sequence number) and how many
+    # points its chart holds ('length'). With delta updates only the rows
+    # appended since then are sent as a Patch, and the oldest points are
+    # dropped so the chart never holds more than `window` points. A full
+    # resend only happens on first load or when the client fell too far behind.
+    #
+    # With a `pyramid` (downsample.MinMaxPyramid over `buffer`) the chart shows
+    # the whole flight instead: exact points while it fits in `window`, then
+    # about `window` min/max points ending in the raw readings no bucket holds
+    # yet. New readings are patched onto that raw tail; the points are only
+    # resent when a new bucket completed (every pyramid.factor readings).
+    #
+    # With a `start` or `end` time the chart is zoomed to that range, always
+    # resent in full (see zoomed_rows, `archive` holds the older readings).
+    zoom = [start, end] if start is not None or end is not None else None
+    if cursor is not None and cursor['total'] == buffer.total and cursor.get('zoom') == zoom:
+        return no_update, no_update
+    if zoom is not None:
+        points = chart_points(zoomed_rows(buffer, window, pyramid, start, end, archive, series), series)
+        return points, {'total': buffer.total, 'length': len(points), 'downsampled': True, 'zoom': zoom}
+    if pyramid is not None and buffer.total > window:
+        # read before the rows, so a bucket completing in between is resent next time
+        buckets = pyramid.levels[0].total
+        if delta and cursor is not None and cursor.get('buckets') == buckets and cursor.get('zoom') is None:
+            rows, total = buffer.snapshot(since=cursor['total'])
+            if rows.shape[1] == total - cursor['total']:
+                patch = Patch()
+                patch.extend(chart_points(rows, series))
+                return patch, {**cursor, 'total': total, 'length': cursor['length'] + rows.shape[1]}
+        points, total = downsampled_points(pyramid, series, window)
+        return points, {'total': total, 'length': len(points), 'downsampled': True, 'buckets': buckets}
+
+    rows, total = buffer.snapshot(window)
+    length = rows.shape[1]
+    new_cursor = {'total': total, 'length': length}
+    new_rows = total - cursor['total'] if cursor is not None else -1
+    if not delta or new_rows < 0 or new_rows > length or cursor.get('downsampled'):
+        return chart_points(rows, series), new_cursor
+
+    patch = Patch()
+    patch.extend(chart_points(rows[:, length - new_rows:], series))
+    for _ in range(cursor['length'] + new_rows - length):
+        del patch[0]
+    return patch, new_cursor
+
+
+def overlay_update(buffers, names, cursor, window, pyramids=None, start=None, end=None, archives=None, sensor=None):
+    # Returns (chart data, new cursor) for a chart overlaying the same sensor
+    # from several links, one series per link name. Each link contributes at
+    # most window / len(buffers) points (downsampled when `pyramids` are
+    # given) and the points are merged in time order, limited to start..end
+    # when zoomed (with the older readings of `sensor` from `archives`, see
+    # zoomed_rows). Always a full resend.
+    total = sum(buffer.total for buffer in buffers)
+    zoom = [start, end] if start is not None or end is not None else None
+    if cursor is not None and cursor.get('overlay') and cursor['total'] == total and cursor.get('zoom') == zoom:
+        return no_update, no_update
+
+    count = max(window // len(buffers), 1)
+    if zoom is not None:
+        archives = archives or [None] * len(buffers)
+        pieces = [
+            zoomed_rows(buffer, count, pyramid, start, end, archive, sensor)
+            for buffer, pyramid, archive in zip(buffers, pyramids or [None] * len(buffers), archives)
+        ]
+    elif pyramids is not None:
+        pieces = [pyramid.query(start, end, max_points=count)[0] for pyramid in pyramids]
+    else:
+        pieces = [buffer.snapshot(count)[0][:2] for buffer in buffers]
+    rows, origin = merge_by_time(pieces)
+    points = [
+        {'time': t, names[i]: v} for t, v, i in zip(rows[0].tolist(), rows[1].tolist(), origin.tolist())
+    ]
+    return points, {'total': total, 'length': len(points), 'overlay': True, 'zoom': zoom}
@@ -0,0 +1,144 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from buffers import RingBuffer
+
+# Metrics derived from the raw readings as they are ingested.
+#
+# Altitude comes from pressure with the standard barometric formula, relative
+# to a reference pressure (the first reading, i.e. the launch site, unless
+# one is given). Vertical velocity and acceleration are the slopes of a
+# least-squares line over the last `window` altitudes and velocities, which
+# copes with uneven packet spacing and noisy pressure better than finite
+# differences. Orientation is smoothed the same way over the unwrapped
+# gyroscope angles, giving angular rates as well.
+#
+# Every fit only needs the last `window` rows before a batch, so updating
+# costs O(window) per new reading, all batches vectorized, however long the
+# flight gets. The telemetry has no gravity vector (the accelerometer only
+# reports a magnitude), so there is nothing to correct gyroscope drift with
+# and the orientation is a smoothing filter rather than a sensor fusion one.
+# Large batches (refilling the buffers at startup) are fitted in chunks of
+# FIT_CHUNK_ROWS so the (window, n) temporaries stay a few tens of MB.
+
+DERIVED_COLUMNS = {
+    'altitude': ('time', 'altitude', 'vertical_velocity', 'vertical_acceleration', 'descent_rate'),
+    'orientation': ('time', 'yaw', 'pitch', 'roll', 'yaw_rate', 'pitch_rate', 'roll_rate'),
+}
+# readings each derived metric is computed from
+DERIVED_SOURCES = {'altitude': 'pressure', 'orientation': 'gyroscope'}
+FIT_CHUNK_ROWS = 65536
+
+
+def barometric_altitude(pressure, reference):
+    # metres above the level where the pressure is `reference` (same unit)
+    return 44330.0 * (1.0 - (pressure / reference) ** (1 / 5.255))
+
+
+def wrap_degrees(angles):
+    return (angles + 180.0) % 360.0 - 180.0
+
+
+class TrailingFit:
+    # Least-squares line over the last `window` samples of one or more series
+    # sharing a time axis, evaluated at every new sample.
+
+    def __init__(self, window):
+        if window < 2:
+            raise ValueError(f"window must be at least 2, got {window}")
+        self.window = window
+        # (1 + series, window - 1) samples preceding the next batch
+        self._tail = None
+
+    def update(self, times, values):
+        # times: (n,), values: (series, n) -> (level, slope), both (series, n)
+        if len(times) > FIT_CHUNK_ROWS:
+            fits = [
+                self.update(times[first:first + FIT_CHUNK_ROWS], values[:, first:first + FIT_CHUNK_ROWS])
+                for first in range(0, len(times), FIT_CHUNK_ROWS)
+            ]
+            return tuple(np.concatenate(parts, axis=1) for parts in zip(*fits))
+        rows = np.vstack([times, values])
+        if self._tail is None:
+            # start as if the first sample had been there all along
+            self._tail = np.repeat(rows[:, :1], self.window - 1, axis=1)
+        rows = np.concatenate([self._tail, rows], axis=1)
+        self._tail = rows[:, -(self.window - 1):].copy()
+
+        windows = sliding_window_view(rows, self.window, axis=1)
+        t = windows[0]
+        t_mean = t.mean(axis=1)
+        t_centered = t - t_mean[:, None]
+        v = windows[1:]
+        v_mean = v.mean(axis=2)
+        variance = (t_centered ** 2).sum(axis=1)
+        covariance = (t_centered * (v - v_mean[..., None])).sum(axis=2)
+        slope = np.divide(covariance, variance, out=np.zeros_like(covariance), where=variance > 0)
+        level = v_mean + slope * (t[:, -1] - t_mean)
+        return level, slope
+
+
+class DerivedMetrics:
+
+    def __init__(self, buffers, window=16, reference_pressure=None, outputs=None):
+        # outputs: ring buffers with DERIVED_COLUMNS to write to (e.g. shared
+        # memory), by default new RingBuffers as large as the source buffers
+        self.sources = buffers
+        self.window = window
+        self.reference_pressure = reference_pressure
+        if outputs is None:
+            outputs = {
+                name: RingBuffer(columns, buffers[DERIVED_SOURCES[name]].capacity)
+                for name, columns in DERIVED_COLUMNS.items()
+            }
+        self.buffers = outputs
+        self._consumed = {name: buffers[source].total for name, source in DERIVED_SOURCES.items()}
+        self._altitude = TrailingFit(window)
+        self._velocity = TrailingFit(window)
+        self._orientation = TrailingFit(window)
+        self._last_angles = None
+
+    def _pending(self, name):
+        # rows of the source buffer not processed yet
+        source = self.sources[DERIVED_SOURCES[name]]
+        available = min(source.total - self._consumed[name], len(source))
+        self._consumed[name] = source.total
+        return source.view(available)
+
+    def update(self, sensor_type):
+        # processes the readings appended since the last call, call after
+        # appending from the thread that writes to the buffer
+        if sensor_type == 'pressure':
+            self._update_altitude()
+        elif sensor_type == 'gyroscope':
+            self._update_orientation()
+
+    def _update_altitude(self):
+        rows = self._pending('altitude')
+        if not rows.shape[1]:
+            return
+        times, pressure = rows[0], rows[1]
+        if self.reference_pressure is None:
+            if not (pressure > 0).any():
+                return
+            self.reference_pressure = float(pressure[pressure > 0][0])
+        altitude = barometric_altitude(pressure, self.reference_pressure)
+        (altitude,), (velocity,) = self._altitude.update(times, altitude[None])
+        _, (acceleration,) = self._velocity.update(times, velocity[None])
+        self.buffers['altitude'].extend(np.column_stack([times, altitude, velocity, acceleration, -velocity]))
+
+    def _update_orientation(self):
+        rows = self._pending('orientation')
+        if not rows.shape[1]:
+            return
+        times, angles = rows[0], rows[1:]
+        # continue the unwrapping from the previous batch so a turn past
+        # +-180 degrees is not seen as a jump
+        if self._last_angles is not None:
+            angles = np.concatenate([self._last_angles[:, None], angles], axis=1)
+        angles = np.degrees(np.unwrap(np.radians(angles), axis=1))
+        if self._last_angles is not None:
+            angles = angles[:, 1:]
+        self._last_angles = angles[:, -1].copy()
+        smoothed, rates = self._orientation.update(times, angles)
+        self.buffers['orientation'].extend(np.column_stack([times, wrap_degrees(smoothed).T, rates.T]))
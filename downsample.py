@@ -0,0 +1,189 @@
+import numpy as np
+
+from buffers import RingBuffer
+from query import range_bounds
+
+# Multi-resolution min/max downsampling for the area charts.
+#
+# Level 1 stores one bucket per `factor` raw readings, level 2 one bucket per
+# `factor` level-1 buckets, and so on. Each bucket keeps its first and last
+# time plus the minimum and maximum reading with their times, so drawing both
+# extremes of every bucket keeps spikes visible. Buckets are only ever
+# appended once complete, so keeping the pyramid up to date costs O(1)
+# amortized per reading. Min/max buckets were picked over LTTB because they
+# can be merged level by level without looking at the raw data again.
+
+BUCKET_COLUMNS = ('time_first', 'time_last', 'time_min', 'min', 'time_max', 'max')
+
+
+def _merge(buckets, factor):
+    # buckets: (6, m * factor) -> (6, m), every `factor` consecutive buckets merged
+    time_first, time_last, time_min, low, time_max, high = buckets.reshape(6, -1, factor)
+    rows = np.arange(low.shape[0])
+    argmin = low.argmin(axis=1)
+    argmax = high.argmax(axis=1)
+    return np.stack([
+        time_first[:, 0],
+        time_last[:, -1],
+        time_min[rows, argmin],
+        low[rows, argmin],
+        time_max[rows, argmax],
+        high[rows, argmax],
+    ])
+
+
+def _points(buckets):
+    # (6, m) buckets -> (2, k) time-ordered (time, value) points, min and max of each bucket
+    time_first, time_last, time_min, low, time_max, high = buckets
+    min_first = time_min <= time_max
+    times = np.stack([np.where(min_first, time_min, time_max), np.where(min_first, time_max, time_min)], axis=1)
+    values = np.stack([np.where(min_first, low, high), np.where(min_first, high, low)], axis=1)
+    # a bucket whose extremes are the same reading only needs one point
+    keep = np.ones(times.shape, dtype=bool)
+    keep[:, 1] = times[:, 0] != times[:, 1]
+    return np.stack([times[keep], values[keep]])
+
+
+def reading_buckets(times, values):
+    # readings as (6, n) buckets of one reading each
+    return np.stack([times, times, times, values, times, values])
+
+
+def bucket_points(buckets, max_points):
+    # (2, k) points of time-ordered (6, m) buckets, merged into at most about max_points / 2 buckets first
+    count = buckets.shape[1]
+    if not count:
+        return np.empty((2, 0))
+    factor = max(-(-2 * count // max(max_points, 2)), 1)
+    complete = count // factor * factor
+    merged = [_merge(buckets[:, :complete], factor)] if complete else []
+    if complete < count:
+        merged.append(_merge(buckets[:, complete:], count - complete))
+    return _points(np.concatenate(merged, axis=1))
+
+
+def archive_points(index, rows, field, start=None, end=None, max_points=500):
+    # (2, k) points of column `field` of time-sorted (n, columns) rows over
+    # start..end, at most about max_points: the readings themselves when
+    # they fit, else min/max points. Ranges long enough for buckets of whole
+    # blocks come from the summaries of `index` (a query.BlockIndex over the
+    # rows), so only the partial blocks at both edges are read.
+    index.update(rows)
+    first, last = range_bounds(rows[:, 0], start, end)
+    if last - first <= max_points:
+        return np.asarray(rows[first:last, [0, field]], dtype=np.float64).T
+    lo = -(-first // index.block_rows)
+    hi = min(last // index.block_rows, len(index))
+    if 2 * (hi - lo) < max_points:
+        values = np.asarray(rows[first:last, [0, field]], dtype=np.float64)
+        return bucket_points(reading_buckets(values[:, 0], values[:, 1]), max_points)
+    i = field - 1
+    blocks = np.stack([
+        index.first[lo:hi], index.last[lo:hi],
+        index.time_min[lo:hi, i], index.min[lo:hi, i], index.time_max[lo:hi, i], index.max[lo:hi, i],
+    ])
+    pieces = []
+    for edge in (rows[first:lo * index.block_rows], rows[hi * index.block_rows:last]):
+        values = np.asarray(edge[:, [0, field]], dtype=np.float64)
+        # each partial block is drawn as one bucket
+        pieces.append(bucket_points(reading_buckets(values[:, 0], values[:, 1]), 2))
+    return np.concatenate([pieces[0], bucket_points(blocks, max_points), pieces[1]], axis=1)
+
+
+def _reach(buffer, start, end):
+    # (rows of `buffer` with start <= time <= end, whether it still holds
+    # everything from `start` on)
+    count, oldest, wrapped = buffer.span(start, end)
+    return count, oldest is not None and (not wrapped or oldest <= start)
+
+
+def level_capacity(capacity, factor):
+    # buckets kept per level for a raw buffer of `capacity` rows
+    return max(capacity // factor, 1)
+
+
+class MinMaxPyramid:
+
+    def __init__(self, buffer, column='value', factor=16, levels=4, level_buffers=None):
+        # level_buffers: ring buffers with BUCKET_COLUMNS to keep the levels
+        # in (e.g. shared memory), by default `levels` new RingBuffers
+        self.buffer = buffer
+        self.column = buffer.columns.index(column)
+        self.factor = factor
+        if level_buffers is None:
+            capacity = level_capacity(buffer.capacity, factor)
+            level_buffers = [RingBuffer(BUCKET_COLUMNS, capacity) for _ in range(levels)]
+        self.levels = list(level_buffers)
+        # rows (or buckets) of the level below already merged into each level
+        self._consumed = [buffer.total] + [level.total for level in self.levels[:-1]]
+
+    def _source(self, level):
+        # (6, n) buckets of the level below that were not merged yet
+        if level == 0:
+            available = min(self.buffer.total - self._consumed[0], len(self.buffer))
+            view = self.buffer.view(available)
+            return reading_buckets(view[0], view[self.column])
+        below = self.levels[level - 1]
+        return below.view(min(below.total - self._consumed[level], len(below)))
+
+    def update(self):
+        # merges every newly completed group of readings, call after appending
+        # from the thread that writes to the buffer
+        if self.buffer.total - self._consumed[0] < self.factor:
+            return
+        for level, target in enumerate(self.levels):
+            pending = self._source(level)
+            complete = pending.shape[1] // self.factor * self.factor
+            if complete == 0:
+                break
+            target.extend(_merge(pending[:, :complete], self.factor).T)
+            below_total = self.buffer.total if level == 0 else self.levels[level - 1].total
+            # anything that fell out of the ring before it was merged is skipped
+            self._consumed[level] = below_total - (pending.shape[1] - complete)
+
+    def query(self, start=None, end=None, max_points=500):
+        # Returns (points, total): (2, k) time-ordered points covering
+        # start..end with at most about max_points points (plus a small
+        # stitched tail of finer data), and the raw buffer's sequence number
+        # the points are up to date with.
+        # Only the rows and buckets that end up in the result are copied.
+        # Safe to call while the writing thread keeps updating the pyramid.
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+
+        # the raw readings are enough if nothing older than them was requested
+        count, covered = _reach(self.buffer, start, end)
+        if count <= max_points and (covered or not len(self.buffer)):
+            raw, total = self.buffer.snapshot(start=start, end=end)
+            return raw[[0, self.column]], total
+
+        # The finest level that reaches back to `start` with few enough
+        # buckets. Levels only keep as many buckets as the raw buffer keeps
+        # rows, so the finer ones may have dropped the start of the range
+        # already; failing that, the coarsest level reaching back to `start`,
+        # or the coarsest level with anything in it.
+        spans = [_reach(level, start, end) for level in self.levels]
+        reaching = [level for level, (_, covered) in enumerate(spans) if covered]
+        fitting = [level for level in reaching if 2 * spans[level][0] <= max_points]
+        filled = [level for level, buckets in enumerate(self.levels) if len(buckets)]
+        if not filled:
+            raw, total = self.buffer.snapshot(start=start, end=end)
+            return raw[[0, self.column]], total
+        chosen = fitting[0] if fitting else reaching[-1] if reaching else filled[-1]
+
+        # stitch: the chosen level, then finer levels and raw readings for the
+        # most recent span the coarser level has no complete bucket for yet
+        pieces = []
+        covered = start
+        for buckets in reversed(self.levels[:chosen + 1]):
+            rows, _ = buckets.snapshot(start=covered, end=end)
+            if pieces:
+                rows = rows[:, rows[0] > covered]
+            if rows.shape[1]:
+                pieces.append(_points(rows))
+                covered = rows[1, -1]
+        raw, total = self.buffer.snapshot(start=covered, end=end)
+        if pieces:
+            raw = raw[:, raw[0] > covered]
+        pieces.append(raw[[0, self.column]])
+        return np.concatenate(pieces, axis=1), total
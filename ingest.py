@@ -0,0 +1,326 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+from archive import ArchiveSink
+from derived import DerivedMetrics
+from downsample import MinMaxPyramid
+from metrics import REGISTRY
+from persistence import BackgroundWriter, CsvSink
+from protocol import BinaryDecoder, read_text_packet
+from schema import ReadingParser
+from shared import (
+    CHART_SENSORS, MIN_CAPACITY, PYRAMID_FACTOR, SharedControl, budget_capacity, create_link_buffers, link_nbytes, unlink_link_buffers
+)
+from sources import open_source, parse_links, parse_size, parse_speed
+from wal import LogSink, PacketLog, recover
+
+# Telemetry ingest: opening the links, decoding packets into the sensor
+# buffers and saving them. The dashboard runs it in reader threads of its own
+# process by default. For several web workers, or to keep ingest away from
+# the GIL of the web process, run it on its own and point the dashboard at it:
+#
+#   python ingest.py
+#   SATDASH_INGEST=shared gunicorn -w 4 'app:create_server()'
+#
+# Both read the same SATDASH_* settings below.
+
+# 'serial' (the radio), 'replay' (a capture file), 'synthetic' (generated data) or 'none'
+TELEMETRY_SOURCE = os.environ.get('SATDASH_SOURCE', 'serial')
+SERIAL_PORT = os.environ.get('SATDASH_SERIAL_PORT', 'COM5')
+BAUD_RATE = 115200
+REPLAY_FILE = os.environ.get('SATDASH_REPLAY_FILE')
+# replay speed multiplier, 'max' for as fast as possible
+REPLAY_SPEED = parse_speed(os.environ.get('SATDASH_REPLAY_SPEED', '1'))
+# synthetic packets per second, 'max' for as fast as possible
+SYNTHETIC_RATE = parse_speed(os.environ.get('SATDASH_SYNTHETIC_RATE', '100'))
+# 'text' for the 'panditas' line protocol, 'binary' for CRC-checked frames
+PROTOCOL = os.environ.get('SATDASH_PROTOCOL', 'text')
+# several receivers or CanSats at once as comma-separated 'name=kind[:target]'
+# links, target being the port for 'serial' and the file for 'replay', e.g.
+# 'cansat1=serial:/dev/ttyUSB0,cansat2=serial:/dev/ttyUSB1'. Unset, there is
+# one link called 'main' using the settings above.
+LINKS = parse_links(os.environ.get('SATDASH_LINKS', '')) or {'main': (TELEMETRY_SOURCE, None)}
+# memory for the in-RAM buffers of all links together, e.g. '512M' or '2G'.
+# Sets how many full-resolution rows are kept per sensor; older readings
+# only stay in RAM as chart pyramid buckets and are spilled to disk (below).
+MEMORY_BUDGET = parse_size(os.environ.get('SATDASH_MEMORY_BUDGET', ''))
+# rows kept in memory per sensor when there is no memory budget, never
+# fewer than MIN_CAPACITY
+BUFFER_CAPACITY = (
+    budget_capacity(MEMORY_BUDGET, len(LINKS)) if MEMORY_BUDGET
+    else max(int(os.environ.get('SATDASH_BUFFER_CAPACITY', 100_000)), MIN_CAPACITY)
+)
+# seconds between automatic saves, 0 only saves when Save Data is pressed
+AUTO_SAVE_INTERVAL = float(os.environ.get('SATDASH_AUTO_SAVE', 0))
+# where saved data goes: 'csv' ({sensor}_data.csv files), 'archive' (typed flight archive) or both
+SAVE_FORMATS = os.environ.get('SATDASH_SAVE_FORMATS', 'csv').split(',')
+ARCHIVE_DIR = os.environ.get('SATDASH_ARCHIVE_DIR', 'flights')
+# readings the derived altitude, velocity and orientation are fitted over
+DERIVED_WINDOW = int(os.environ.get('SATDASH_DERIVED_WINDOW', 16))
+# pressure altitude 0 is at, in the pressure sensor's unit; unset, the first reading
+GROUND_PRESSURE = float(os.environ['SATDASH_GROUND_PRESSURE']) if os.environ.get('SATDASH_GROUND_PRESSURE') else None
+# directory of the crash-safe packet logs, one {link}.wal per link, unset for none.
+# On startup the buffers are refilled from existing logs, move them away to
+# start a new flight.
+WAL_DIR = os.environ.get('SATDASH_WAL_DIR', '')
+# seconds between writes to the packet logs, and at least between fsyncs of them
+WAL_FLUSH_INTERVAL = float(os.environ.get('SATDASH_WAL_FLUSH', 0.2))
+WAL_SYNC_INTERVAL = float(os.environ.get('SATDASH_WAL_SYNC', 1.0))
+# keep every reading at full resolution in flight archives under SPILL_DIR/{link},
+# written every SPILL_INTERVAL seconds, well before it leaves the in-RAM
+# buffers. On by default with a memory budget.
+SPILL = os.environ.get('SATDASH_SPILL', '1' if MEMORY_BUDGET else '0') == '1'
+SPILL_DIR = os.environ.get('SATDASH_SPILL_DIR', os.path.join(ARCHIVE_DIR, 'spill'))
+SPILL_INTERVAL = float(os.environ.get('SATDASH_SPILL_INTERVAL', 1.0))
+# name prefix of the shared memory segments of a standalone ingest process
+SHM_PREFIX = os.environ.get('SATDASH_SHM_PREFIX', 'satdash')
+
+# set to stop the reader threads before they write their next reading
+stopping = threading.Event()
+
+decode_timer = REGISTRY.timer('satdash_decode_seconds', "Time spent decoding and parsing packets", protocol=PROTOCOL)
+
+
+def chart_pyramids(buffers):
+    return {sensor: MinMaxPyramid(buffers[sensor], factor=PYRAMID_FACTOR) for sensor in CHART_SENSORS}
+
+
+def derived_metrics(buffers):
+    return DerivedMetrics(buffers, window=DERIVED_WINDOW, reference_pressure=GROUND_PRESSURE)
+
+
+def open_link(kind, target=None):
+    return open_source(
+        kind,
+        port=target or SERIAL_PORT,
+        baud_rate=BAUD_RATE,
+        replay_file=target or REPLAY_FILE,
+        speed=REPLAY_SPEED,
+        rate=SYNTHETIC_RATE,
+        protocol=PROTOCOL
+    )
+
+
+def link_sinks(link):
+    # a single link saves where it always did, several get a directory each
+    directory = '.' if len(LINKS) == 1 else link
+    save_sinks = {
+        'csv': lambda: CsvSink(directory),
+        'archive': lambda: ArchiveSink(ARCHIVE_DIR if len(LINKS) == 1 else os.path.join(ARCHIVE_DIR, link)),
+    }
+    return [save_sinks[name]() for name in SAVE_FORMATS]
+
+
+def start_writers(link_buffers):
+    writers = {
+        link: BackgroundWriter(buffers, link_sinks(link), auto_save_interval=AUTO_SAVE_INTERVAL or None)
+        for link, buffers in link_buffers.items()
+    }
+    for writer in writers.values():
+        writer.start()
+    return writers
+
+
+def log_path(link):
+    return os.path.join(WAL_DIR, f'{link}.wal')
+
+
+def recover_link(link, buffers, pyramids, derived, spill=None):
+    # refills the buffers of a link from its packet log, before any reader or
+    # writer starts. With a spill writer (not started yet) every recovered
+    # reading is also spilled before the ring overwrites it.
+    if not WAL_DIR or not os.path.exists(log_path(link)):
+        return
+    def extended(sensor_type):
+        if sensor_type in pyramids:
+            pyramids[sensor_type].update()
+        derived.update(sensor_type)
+        if spill is not None:
+            spill.save()
+
+    started = time.perf_counter()
+    loaded, bad = recover(PacketLog(log_path(link)), buffers, extended)
+    print(f"Recovered {sum(loaded.values())} readings of {link} from {log_path(link)} in {time.perf_counter() - started:.2f} s"
+          + (f", skipped {bad} corrupt records" if bad else ""))
+
+
+def start_logs(link_buffers):
+    # one background writer per link appending every reading to its packet log
+    if not WAL_DIR:
+        return {}
+    logs = {
+        link: BackgroundWriter(
+            buffers, [LogSink(PacketLog(log_path(link), WAL_SYNC_INTERVAL))], auto_save_interval=WAL_FLUSH_INTERVAL
+        )
+        for link, buffers in link_buffers.items()
+    }
+    for log in logs.values():
+        log.start()
+    return logs
+
+
+def spill_writer(link, buffers):
+    # background writer archiving every reading of a link before the ring
+    # overwrites it, None without SPILL. Every start spills into a new session,
+    # so it is created before recover_link, while the buffers are still empty:
+    # its cursors then cover the recovered readings and the new session holds
+    # the whole packet log, restarts included.
+    if not SPILL:
+        return None
+    return BackgroundWriter(buffers, [ArchiveSink(os.path.join(SPILL_DIR, link))], auto_save_interval=SPILL_INTERVAL)
+
+
+def start_spills(spills):
+    for spill in spills.values():
+        spill.start()
+    return spills
+
+
+def read_text(connection, buffers, pyramids, parser, link, notify=None, derived=None):
+    resyncs = REGISTRY.counter('satdash_resyncs_total', "Packets skipped to find the next sync word", protocol='text', link=link)
+    while not stopping.is_set():
+        try:
+            packet = read_text_packet(connection)
+            if stopping.is_set():
+                return
+
+            if packet is not None:
+                time, sensor_type, value = packet
+
+                # parsed and validated once here, consumers only see floats
+                with decode_timer.time():
+                    row = parser.parse(sensor_type, time, value)
+
+                # the only writer, readers take snapshots so this never waits
+                buffers[sensor_type].append(row)
+                if sensor_type in pyramids:
+                    pyramids[sensor_type].update()
+                if derived is not None:
+                    derived.update(sensor_type)
+                if notify is not None:
+                    notify((sensor_type,))
+
+            else:
+                resyncs.inc()
+                print('Incorrect code')
+
+        except (IndexError, ValueError) as e:
+            print(f"Error parsing data: {e}")
+
+
+def read_binary(connection, buffers, pyramids, parser, link, notify=None, derived=None):
+    decoder = BinaryDecoder()
+    REGISTRY.gauge('satdash_resyncs_total', lambda: decoder.bad_frames, "Packets skipped to find the next sync word", kind='counter', protocol='binary', link=link)
+    while not stopping.is_set():
+        # block for at least one byte, then take everything already buffered
+        chunk = connection.read(max(1, connection.in_waiting))
+        if stopping.is_set():
+            return
+        bad_frames = decoder.bad_frames
+        with decode_timer.time():
+            batches = decoder.decode(chunk)
+        if decoder.bad_frames != bad_frames:
+            print(f"Bad frame on {link}, resynchronizing ({decoder.bad_frames} so far)")
+
+        batches = {sensor_type: parser.filter(sensor_type, rows) for sensor_type, rows in batches.items()}
+        batches = {sensor_type: rows for sensor_type, rows in batches.items() if len(rows)}
+        if batches:
+            for sensor_type, rows in batches.items():
+                buffers[sensor_type].extend(rows)
+                if sensor_type in pyramids:
+                    pyramids[sensor_type].update()
+                if derived is not None:
+                    derived.update(sensor_type)
+            if notify is not None:
+                notify(batches)
+
+
+def read_link(connection, buffers, pyramids, parser, link, notify=None, derived=None):
+    if PROTOCOL == 'binary':
+        read_binary(connection, buffers, pyramids, parser, link, notify, derived)
+    else:
+        read_text(connection, buffers, pyramids, parser, link, notify, derived)
+
+
+def register_link_metrics(link, buffers, writer=None, parser=None, connection=None, pyramids=None, derived=None, spill=None):
+    for sensor in buffers:
+        REGISTRY.gauge('satdash_readings_total', lambda sensor=sensor: buffers[sensor].total, "Readings stored", kind='counter', link=link, sensor=sensor)
+        REGISTRY.gauge('satdash_snapshot_retries_total', lambda sensor=sensor: buffers[sensor].retries, "Buffer snapshots copied again because of a concurrent write", kind='counter', link=link, sensor=sensor)
+        if writer is not None:
+            REGISTRY.gauge('satdash_unsaved_dropped_total', lambda sensor=sensor: writer.dropped[sensor], "Readings overwritten before being saved", kind='counter', link=link, sensor=sensor)
+    if parser is not None:
+        for sensor in parser.rejected:
+            REGISTRY.gauge('satdash_rejected_readings_total', lambda sensor=sensor: parser.rejected[sensor], "Malformed readings dropped at ingest", kind='counter', link=link, sensor=sensor)
+    if connection is not None:
+        REGISTRY.gauge('satdash_serial_in_waiting_bytes', lambda: connection.in_waiting, "Bytes waiting in the serial input queue", link=link)
+    if derived is not None:
+        REGISTRY.gauge('satdash_buffer_bytes', lambda: link_nbytes(buffers, pyramids or {}, derived), "Memory held by the in-RAM buffers", link=link)
+    if spill is not None:
+        for sensor in buffers:
+            REGISTRY.gauge('satdash_spill_dropped_total', lambda sensor=sensor: spill.dropped[sensor], "Readings overwritten before being spilled to disk", kind='counter', link=link, sensor=sensor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run SatDash telemetry ingest in its own process, sharing the buffers with the dashboard.")
+    parser.add_argument('--cleanup', action='store_true', help="remove the shared memory segments and exit")
+    args = parser.parse_args()
+
+    if args.cleanup:
+        for link in LINKS:
+            unlink_link_buffers(SHM_PREFIX, link)
+        SharedControl.create(SHM_PREFIX).unlink()
+        print(f"Removed the '{SHM_PREFIX}' shared memory segments")
+        return
+
+    control = SharedControl.create(SHM_PREFIX)
+    link_buffers = {}
+    spills = {}
+    readers = []
+    for link in LINKS:
+        buffers, pyramids, derived = create_link_buffers(
+            SHM_PREFIX, link, BUFFER_CAPACITY, DERIVED_WINDOW, GROUND_PRESSURE
+        )
+        link_buffers[link] = buffers
+        spill = spill_writer(link, buffers)
+        if spill is not None:
+            spills[link] = spill
+        recover_link(link, buffers, pyramids, derived, spill)
+        link_parser = ReadingParser()
+        connection = open_link(*LINKS[link])
+        reader = threading.Thread(
+            target=read_link, args=(connection, buffers, pyramids, link_parser, link, None, derived),
+            name=f'reader-{link}', daemon=True
+        )
+        reader.start()
+        readers.append(reader)
+    writers = start_writers(link_buffers)
+    start_logs(link_buffers)
+    start_spills(spills)
+    print(f"Ingesting {', '.join(LINKS)} into shared memory '{SHM_PREFIX}' (pid {os.getpid()})")
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    save_requests = control.save_requests
+    try:
+        while True:
+            # Save Data clicks of the dashboards arrive through the control segment
+            time.sleep(0.2)
+            if control.save_requests != save_requests:
+                save_requests = control.save_requests
+                for writer in writers.values():
+                    writer.request_save()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # a reader killed in the middle of a write would leave its buffer
+        # looking busy to the dashboards, so let the readers finish theirs
+        stopping.set()
+        for reader in readers:
+            reader.join(timeout=1.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import functools
+import threading
+import time
+
+# Lightweight in-process metrics, rendered in the Prometheus text format on
+# /metrics and summarized in the optional diagnostics tile. Timers keep only
+# count, sum and max, so observing one costs a lock and a few additions.
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Timer:
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def time(self):
+        return _Timing(self)
+
+
+class _Timing:
+    __slots__ = ('timer', 'started')
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.observe(time.perf_counter() - self.started)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Registry:
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _metric(self, kind, name, help, labels, factory):
+        with self._lock:
+            family = self._families.setdefault(name, {'kind': kind, 'help': help, 'samples': {}})
+            if family['kind'] != kind:
+                raise ValueError(f"metric {name} is already registered as a {family['kind']}")
+            return family['samples'].setdefault(_labels(labels), factory())
+
+    def counter(self, name, help='', **labels):
+        return self._metric('counter', name, help, labels, Counter)
+
+    def timer(self, name, help='', **labels):
+        return self._metric('summary', name, help, labels, Timer)
+
+    def gauge(self, name, read, help='', kind='gauge', **labels):
+        # `read` is called at scrape time, so values the app already keeps
+        # (buffer totals, decoder counts, queue depth) cost nothing to export
+        with self._lock:
+            family = self._families.setdefault(name, {'kind': kind, 'help': help, 'samples': {}})
+            family['samples'][_labels(labels)] = read
+
+    def _families_snapshot(self):
+        with self._lock:
+            return [
+                (name, family['kind'], family['help'], dict(family['samples']))
+                for name, family in self._families.items()
+            ]
+
+    @staticmethod
+    def _values(sample):
+        # (suffix, value) pairs of one sample
+        if isinstance(sample, Timer):
+            return [('_count', sample.count), ('_sum', sample.sum), ('_max', sample.max)]
+        if isinstance(sample, Counter):
+            return [('', sample.value)]
+        try:
+            value = sample()
+        except Exception:
+            return []
+        return [] if value is None else [('', value)]
+
+    def render(self):
+        lines = []
+        for name, kind, help, samples in self._families_snapshot():
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            maxima = []
+            for labels, sample in samples.items():
+                for suffix, value in self._values(sample):
+                    if suffix == '_max':
+                        maxima.append((labels, value))
+                    else:
+                        lines.append(f'{name}{suffix}{_format_labels(labels)} {value}')
+            if maxima:
+                # not part of the summary type, exported as its own gauge
+                lines.append(f'# TYPE {name}_max gauge')
+                lines.extend(f'{name}_max{_format_labels(labels)} {value}' for labels, value in maxima)
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        # one line per metric, timers as count x mean (max) in ms
+        lines = []
+        for name, kind, help, samples in self._families_snapshot():
+            for labels, sample in samples.items():
+                label = name + _format_labels(labels)
+                if isinstance(sample, Timer):
+                    mean = sample.sum / sample.count * 1000 if sample.count else 0
+                    lines.append(f"{label}: {sample.count} x {mean:.2f} ms (max {sample.max * 1000:.2f} ms)")
+                else:
+                    for _, value in self._values(sample):
+                        lines.append(f"{label}: {value}")
+        return lines
+
+
+REGISTRY = Registry()
+
+
+def timed(name, help='', registry=REGISTRY, **labels):
+    # decorator recording every call of the wrapped function in a timer
+    timer = registry.timer(name, help, **labels)
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer.time():
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
@@ -0,0 +1,84 @@
+import os
+import threading
+
+
+def csv_frame(sensor_type, view):
+    # CSV layout stays time, sensor_type, value (gyroscope as "yaw,pitch,roll")
+    import pandas as pd  # only needed once something is saved
+    if sensor_type == 'gyroscope':
+        values = [','.join(map(str, angles)) for angles in view[1:].T.tolist()]
+    else:
+        values = view[1]
+    return pd.DataFrame({
+        'time': view[0],
+        'sensor_type': sensor_type,
+        'value': values
+    })
+
+
+class CsvSink:
+    # Appends to one {sensor}_data.csv per sensor.
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+
+    def write(self, sensor_type, view):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, f'{sensor_type}_data.csv')
+        csv_frame(sensor_type, view).to_csv(filename, mode='a', header=not os.path.exists(filename), index=False)
+        print(f"New data appended to {filename}.")
+
+
+class BackgroundWriter:
+    # Persists sensor buffers from a background thread.
+    #
+    # Every sensor has a cursor holding the buffer sequence number up to which
+    # rows were already written. A save takes a snapshot of only the rows past
+    # the cursor, so ingest never waits for the disk I/O. Saves
+    # run when requested and, if auto_save_interval is set, periodically.
+
+    def __init__(self, buffers, sinks, auto_save_interval=None):
+        self.buffers = buffers
+        self.sinks = list(sinks)
+        self.auto_save_interval = auto_save_interval
+        # rows already in the buffers (e.g. recovered from a packet log) are not written again
+        self.cursors = {sensor: buffer.total for sensor, buffer in buffers.items()}
+        # rows that left the ring buffer before they could be saved
+        self.dropped = {sensor: 0 for sensor in buffers}
+        self._requested = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def request_save(self):
+        self._requested.set()
+
+    def _run(self):
+        while True:
+            requested = self._requested.wait(timeout=self.auto_save_interval)
+            self._requested.clear()
+            try:
+                if not self.save() and requested:
+                    print("No new data to save.")
+            except OSError as e:
+                print(f"Error saving data: {e}")
+
+    def save(self):
+        saved = False
+        for sensor_type, buffer in self.buffers.items():
+            rows, total = buffer.snapshot(since=self.cursors[sensor_type])
+            new_rows = total - self.cursors[sensor_type]
+            if not new_rows:
+                continue
+
+            if rows.shape[1] < new_rows:
+                self.dropped[sensor_type] += new_rows - rows.shape[1]
+                print(f"{new_rows - rows.shape[1]} {sensor_type} rows were overwritten before being saved.")
+            for sink in self.sinks:
+                sink.write(sensor_type, rows)
+            self.cursors[sensor_type] = total
+            saved = True
+        return saved
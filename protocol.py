@@ -0,0 +1,139 @@
+import numpy as np
+
+from buffers import SENSOR_COLUMNS
+
+# Text protocol: every reading is four lines, 'panditas', time, sensor_type, value.
+TEXT_SYNC = 'panditas'
+
+# Binary protocol: fixed 21-byte little-endian frames
+#
+#   sync   u16   0x5AA5 (bytes A5 5A on the wire)
+#   sensor u8    see SENSOR_IDS
+#   time   f32   seconds
+#   values 3xf32 value, unused slots are 0 (gyroscope uses all three)
+#   crc    u16   CRC-16/CCITT-FALSE over the preceding 19 bytes
+SYNC_WORD = 0x5AA5
+SYNC_BYTES = SYNC_WORD.to_bytes(2, 'little')
+SENSOR_IDS = {
+    1: 'temperature',
+    2: 'pressure',
+    3: 'velocity',
+    4: 'light',
+    5: 'accelerometer',
+    6: 'gyroscope',
+}
+SENSOR_CODES = {sensor: code for code, sensor in SENSOR_IDS.items()}
+
+FRAME_DTYPE = np.dtype([
+    ('sync', '<u2'),
+    ('sensor', 'u1'),
+    ('time', '<f4'),
+    ('values', '<f4', (3,)),
+    ('crc', '<u2'),
+])
+FRAME_SIZE = FRAME_DTYPE.itemsize
+
+
+def _crc_table():
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(frames):
+    # CRC-16/CCITT-FALSE of each row of a (n, k) uint8 array, computed for all
+    # rows at once by walking the k byte positions.
+    crc = np.full(len(frames), 0xFFFF, dtype=np.uint16)
+    for i in range(frames.shape[1]):
+        crc = CRC_TABLE[(crc >> 8) ^ frames[:, i]] ^ (crc << 8)
+    return crc
+
+
+def frame_array(sensor_type, rows):
+    # rows: (n, len(SENSOR_COLUMNS[sensor_type])) array of time + values
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(SENSOR_COLUMNS[sensor_type]))
+    frames = np.zeros(len(rows), dtype=FRAME_DTYPE)
+    frames['sync'] = SYNC_WORD
+    frames['sensor'] = SENSOR_CODES[sensor_type]
+    frames['time'] = rows[:, 0]
+    frames['values'][:, :rows.shape[1] - 1] = rows[:, 1:]
+    raw = frames.view(np.uint8).reshape(len(rows), FRAME_SIZE)
+    frames['crc'] = crc16(raw[:, :-2])
+    return frames
+
+
+def encode_frames(sensor_type, rows):
+    return frame_array(sensor_type, rows).tobytes()
+
+
+def read_text_packet(connection):
+    # Returns (time, sensor_type, value) strings, or None if the sync line is wrong.
+    code = connection.readline().decode('utf-8').strip()
+    if code != TEXT_SYNC:
+        return None
+    time = connection.readline().decode('utf-8').strip()
+    sensor_type = connection.readline().decode('utf-8').strip()
+    value = connection.readline().decode('utf-8').strip()
+    return time, sensor_type, value
+
+
+class BinaryDecoder:
+    # Incremental decoder for the binary frame protocol. Feed it whatever
+    # bytes are available and it returns the complete frames, grouped per
+    # sensor as (n, columns) float arrays. After a bad frame it skips ahead to
+    # the next sync word.
+
+    def __init__(self):
+        self._pending = b''
+        self.frames = 0
+        self.bad_frames = 0
+
+    def decode(self, chunk):
+        data = self._pending + chunk
+        buf = np.frombuffer(data, dtype=np.uint8)
+        decoded = []
+        pos = 0
+        while True:
+            start = data.find(SYNC_BYTES, pos)
+            if start < 0:
+                # keep a trailing byte that may be the first half of a sync word
+                pos = max(pos, len(data) - 1)
+                break
+            count = (len(data) - start) // FRAME_SIZE
+            if count == 0:
+                pos = start
+                break
+            raw = buf[start:start + count * FRAME_SIZE].reshape(count, FRAME_SIZE)
+            frames = raw.reshape(-1).view(FRAME_DTYPE)
+            valid = (frames['sync'] == SYNC_WORD) & (crc16(raw[:, :-2]) == frames['crc'])
+            if valid.all():
+                decoded.append(frames)
+                pos = start + count * FRAME_SIZE
+                continue
+            bad = int(np.argmin(valid))
+            decoded.append(frames[:bad])
+            self.bad_frames += 1
+            pos = start + bad * FRAME_SIZE + 1
+        self._pending = data[pos:]
+
+        batches = {}
+        if not decoded:
+            return batches
+        frames = np.concatenate(decoded)
+        self.frames += len(frames)
+        for code, sensor_type in SENSOR_IDS.items():
+            selected = frames[frames['sensor'] == code]
+            if len(selected):
+                width = len(SENSOR_COLUMNS[sensor_type]) - 1
+                rows = np.empty((len(selected), width + 1), dtype=np.float64)
+                rows[:, 0] = selected['time']
+                rows[:, 1:] = selected['values'][:, :width]
+                batches[sensor_type] = rows
+        self.bad_frames += int(np.isin(frames['sensor'], list(SENSOR_IDS), invert=True).sum())
+        return batches
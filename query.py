@@ -0,0 +1,248 @@
+import threading
+
+import numpy as np
+
+# Time-range queries over time-sorted (n, columns) rows, such as the files
+# of a flight archive or a snapshot of a sensor buffer.
+#
+# BlockIndex summarizes the rows in blocks of `block_rows`: first and last
+# time, and per value column the sum and the min and max with their times.
+# A range query binary searches the sorted times, combines the summaries of
+# the blocks fully inside the range and only scans the rows of the partial
+# blocks at both edges, so it reads O(log n + n / block_rows + block_rows)
+# values instead of the whole range. Summaries of complete blocks never
+# change, so the index is extended as rows are appended. LiveBlockIndex does
+# the same for a ring buffer, summarizing rows before the ring overwrites them.
+
+BLOCK_ROWS = 4096
+# blocks summarized at a time when indexing, bounding the memory it takes
+UPDATE_BLOCKS = 256
+
+
+def range_bounds(times, start=None, end=None):
+    # row indices first..last of the rows with start <= time <= end
+    first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+    last = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+    return first, max(first, last)
+
+
+def summarize(rows):
+    # summary of (n, columns) rows, n > 0, in the layout BlockIndex keeps per block
+    rows = np.asarray(rows, dtype=np.float64)
+    times, values = rows[:, 0], rows[:, 1:]
+    fields = np.arange(values.shape[1])
+    argmin = values.argmin(axis=0)
+    argmax = values.argmax(axis=0)
+    return {
+        'count': len(rows),
+        'first': times[0],
+        'last': times[-1],
+        'sum': values.sum(axis=0),
+        'min': values[argmin, fields],
+        'time_min': times[argmin],
+        'max': values[argmax, fields],
+        'time_max': times[argmax],
+    }
+
+
+def combine(parts):
+    # one summary out of summaries of consecutive, time-ordered ranges, None
+    # for an empty range (parts may be None too)
+    parts = [part for part in parts if part and part['count']]
+    if not parts:
+        return None
+    fields = np.arange(len(parts[0]['sum']))
+    low = np.stack([part['min'] for part in parts])
+    high = np.stack([part['max'] for part in parts])
+    argmin = low.argmin(axis=0)
+    argmax = high.argmax(axis=0)
+    return {
+        'count': sum(part['count'] for part in parts),
+        'first': parts[0]['first'],
+        'last': parts[-1]['last'],
+        'sum': np.sum([part['sum'] for part in parts], axis=0),
+        'min': low[argmin, fields],
+        'time_min': np.stack([part['time_min'] for part in parts])[argmin, fields],
+        'max': high[argmax, fields],
+        'time_max': np.stack([part['time_max'] for part in parts])[argmax, fields],
+    }
+
+
+def aggregate_result(summary, columns):
+    # JSON-friendly aggregate of a summary, {'count': 0} for an empty range
+    if summary is None:
+        return {'count': 0}
+    return {
+        'count': int(summary['count']),
+        'start': float(summary['first']),
+        'end': float(summary['last']),
+        'fields': {
+            field: {
+                'min': float(summary['min'][i]),
+                'time_min': float(summary['time_min'][i]),
+                'max': float(summary['max'][i]),
+                'time_max': float(summary['time_max'][i]),
+                'sum': float(summary['sum'][i]),
+                'mean': float(summary['sum'][i] / summary['count']),
+            }
+            for i, field in enumerate(columns[1:])
+        },
+    }
+
+
+def aggregate_rows(rows, columns, start=None, end=None):
+    # Aggregate of time-sorted (n, columns) rows by a plain scan of the range,
+    # for rows without a BlockIndex such as a buffer snapshot.
+    first, last = range_bounds(rows[:, 0], start, end)
+    return aggregate_result(summarize(rows[first:last]) if last > first else None, columns)
+
+
+class BlockIndex:
+
+    def __init__(self, columns, block_rows=BLOCK_ROWS):
+        self.columns = tuple(columns)
+        self.block_rows = block_rows
+        width = len(self.columns) - 1
+        self.first = np.empty(0)
+        self.last = np.empty(0)
+        self.sum = np.empty((0, width))
+        self.min = np.empty((0, width))
+        self.time_min = np.empty((0, width))
+        self.max = np.empty((0, width))
+        self.time_max = np.empty((0, width))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.first)
+
+    def update(self, rows):
+        # summarizes the complete blocks of `rows` (the whole, grown array)
+        # that are not in the index yet
+        with self._lock:
+            done = len(self) * self.block_rows
+            complete = len(rows) // self.block_rows * self.block_rows
+            step = UPDATE_BLOCKS * self.block_rows
+            for first in range(done, complete, step):
+                self._extend(rows[first:min(first + step, complete)])
+
+    def _extend(self, rows):
+        # appends the summaries of whole blocks of rows
+        blocks = np.asarray(rows, dtype=np.float64).reshape(-1, self.block_rows, len(self.columns))
+        times, values = blocks[:, :, 0], blocks[:, :, 1:]
+        block, fields = np.indices(values.shape[::2])
+        argmin = values.argmin(axis=1)
+        argmax = values.argmax(axis=1)
+        self.first = np.concatenate([self.first, times[:, 0]])
+        self.last = np.concatenate([self.last, times[:, -1]])
+        self.sum = np.concatenate([self.sum, values.sum(axis=1)])
+        self.min = np.concatenate([self.min, values[block, argmin, fields]])
+        self.time_min = np.concatenate([self.time_min, times[block, argmin]])
+        self.max = np.concatenate([self.max, values[block, argmax, fields]])
+        self.time_max = np.concatenate([self.time_max, times[block, argmax]])
+
+    def _blocks(self, lo, hi):
+        # summary of the complete blocks lo..hi-1
+        fields = np.arange(self.sum.shape[1])
+        argmin = self.min[lo:hi].argmin(axis=0) + lo
+        argmax = self.max[lo:hi].argmax(axis=0) + lo
+        return {
+            'count': (hi - lo) * self.block_rows,
+            'first': self.first[lo],
+            'last': self.last[hi - 1],
+            'sum': self.sum[lo:hi].sum(axis=0),
+            'min': self.min[argmin, fields],
+            'time_min': self.time_min[argmin, fields],
+            'max': self.max[argmax, fields],
+            'time_max': self.time_max[argmax, fields],
+        }
+
+    def summary(self, rows, start=None, end=None):
+        # summary of start <= time <= end, None when empty. `rows` are the
+        # indexed rows, possibly grown since the last query.
+        self.update(rows)
+        first, last = range_bounds(rows[:, 0], start, end)
+        # complete blocks inside first..last
+        lo = -(-first // self.block_rows)
+        hi = min(last // self.block_rows, len(self))
+        if hi <= lo:
+            return summarize(rows[first:last]) if last > first else None
+        return combine([
+            summarize(rows[first:lo * self.block_rows]) if first < lo * self.block_rows else None,
+            self._blocks(lo, hi),
+            summarize(rows[hi * self.block_rows:last]) if hi * self.block_rows < last else None,
+        ])
+
+    def aggregate(self, rows, start=None, end=None):
+        # Count, min, max (with their times), sum and mean of every value
+        # column over start <= time <= end.
+        return aggregate_result(self.summary(rows, start, end), self.columns)
+
+
+class LiveBlockIndex:
+    # Block summaries of a ring buffer (buffers.RingBuffer) that keeps
+    # growing while its oldest rows are overwritten. New rows are summarized
+    # on the next query, so a query costs the rows appended since the last
+    # one plus O(log n + blocks + block_rows), never a scan of the ring. The
+    # summaries outlive the rows: ranges older than the ring are still
+    # aggregated, from the whole blocks inside them.
+
+    def __init__(self, buffer, block_rows=BLOCK_ROWS):
+        self.buffer = buffer
+        self.block_rows = block_rows
+        self._reset()
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self.index = BlockIndex(self.buffer.columns, self.block_rows)
+        # rows of the block being filled, and the buffer sequence number they end at
+        self._pending = np.empty((0, len(self.buffer.columns)))
+        self._seen = 0
+
+    def update(self):
+        with self._lock:
+            rows, total = self.buffer.snapshot(since=self._seen)
+            rows = rows.T
+            if total < self._seen or (len(rows) and len(self.index) and rows[0, 0] < self.index.last[-1]):
+                # the buffer was emptied and refilled (a restarted ingest.py)
+                self._reset()
+                rows, total = self.buffer.snapshot()
+                rows = rows.T
+            elif len(rows) < total - self._seen:
+                # rows were overwritten before being summarized, no block spans the gap
+                self._pending = self._pending[:0]
+            rows = np.concatenate([self._pending, rows])
+            complete = len(rows) // self.block_rows * self.block_rows
+            if complete:
+                self.index._extend(rows[:complete])
+            self._pending = rows[complete:]
+            self._seen = total
+
+    def _edge(self, start, end, after=None, before=None):
+        # summary of the rows still in the ring in start..end, strictly after
+        # `after` and before `before`
+        rows, _ = self.buffer.snapshot(start=start, end=end)
+        times = rows[0]
+        keep = np.ones(len(times), dtype=bool)
+        if after is not None:
+            keep &= times > after
+        if before is not None:
+            keep &= times < before
+        return summarize(rows[:, keep].T) if keep.any() else None
+
+    def summary(self, start=None, end=None):
+        # summary of start <= time <= end, None when empty
+        self.update()
+        index = self.index
+        lo = 0 if start is None else int(np.searchsorted(index.first, start, side='left'))
+        hi = len(index) if end is None else int(np.searchsorted(index.last, end, side='right'))
+        if hi <= lo:
+            return self._edge(start, end)
+        return combine([
+            self._edge(start, index.first[lo], before=index.first[lo]),
+            index._blocks(lo, hi),
+            self._edge(index.last[hi - 1], end, after=index.last[hi - 1]),
+        ])
+
+    def aggregate(self, start=None, end=None):
+        # as BlockIndex.aggregate
+        return aggregate_result(self.summary(start, end), self.index.columns)
@@ -0,0 +1,66 @@
+import math
+
+import numpy as np
+
+
+class SensorSchema:
+    # Typed layout of one sensor: a time column followed by one float per field.
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+        self.columns = ('time',) + self.fields
+
+    def parse(self, time, value):
+        # Parses the text protocol's time and value strings into a row,
+        # e.g. ('1.5', '3,4,5') -> [1.5, 3.0, 4.0, 5.0] for a 3-vector.
+        parts = value.split(',')
+        if len(parts) != len(self.fields):
+            raise ValueError(f"expected {len(self.fields)} values for {self.name}, got {value!r}")
+        row = [float(time)] + [float(part) for part in parts]
+        if not all(math.isfinite(x) for x in row):
+            raise ValueError(f"non-finite reading for {self.name}: {time!r}, {value!r}")
+        return row
+
+    def valid(self, rows):
+        # mask of the rows in an (n, columns) array that hold only finite numbers
+        return np.isfinite(rows).all(axis=1)
+
+
+SENSOR_SCHEMAS = {
+    'temperature': SensorSchema('temperature', ('value',)),
+    'pressure': SensorSchema('pressure', ('value',)),
+    'velocity': SensorSchema('velocity', ('value',)),
+    'light': SensorSchema('light', ('value',)),
+    'accelerometer': SensorSchema('accelerometer', ('value',)),
+    'gyroscope': SensorSchema('gyroscope', ('yaw', 'pitch', 'roll')),
+}
+
+
+class ReadingParser:
+    # Parses readings once at ingest and counts the ones it rejects, per sensor
+    # ('unknown' for sensor types missing from the registry).
+
+    def __init__(self, schemas=SENSOR_SCHEMAS):
+        self.schemas = schemas
+        self.rejected = {sensor: 0 for sensor in schemas}
+        self.rejected['unknown'] = 0
+
+    def parse(self, sensor_type, time, value):
+        schema = self.schemas.get(sensor_type)
+        if schema is None:
+            self.rejected['unknown'] += 1
+            raise ValueError(f"unknown sensor type {sensor_type!r}")
+        try:
+            return schema.parse(time, value)
+        except ValueError:
+            self.rejected[sensor_type] += 1
+            raise
+
+    def filter(self, sensor_type, rows):
+        # drops the non-finite rows of a decoded binary batch
+        valid = self.schemas[sensor_type].valid(rows)
+        if valid.all():
+            return rows
+        self.rejected[sensor_type] += int((~valid).sum())
+        return rows[valid]
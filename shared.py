@@ -0,0 +1,230 @@
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from buffers import SENSOR_COLUMNS, RingBuffer
+from derived import DERIVED_COLUMNS, DerivedMetrics
+from downsample import BUCKET_COLUMNS, MinMaxPyramid, level_capacity
+
+# Sensor buffers in POSIX shared memory, so the ingest daemon (ingest.py) can
+# write them while any number of dashboard processes read them.
+#
+# Every segment starts with a small int64 header holding the ring state
+# (sequence, head, size, total) and its shape, followed by the same mirrored
+# storage RingBuffer uses. The sequence lock works across processes as it
+# does across threads: the daemon is the only writer, readers retry their
+# copy when the sequence moved. Segments are named
+# '{prefix}-{link}-{sensor}' ('-L{n}' appended for chart pyramid levels).
+
+HEADER_FIELDS = 8
+HEADER_BYTES = HEADER_FIELDS * 8
+SEQUENCE, HEAD, SIZE, TOTAL, CAPACITY, COLUMNS = range(6)
+
+PYRAMID_FACTOR = 16
+PYRAMID_LEVELS = 4
+# smallest sensor buffer: pyramid levels keep capacity // PYRAMID_FACTOR
+# buckets, with fewer rows than this the coarser levels never fill
+MIN_CAPACITY = PYRAMID_FACTOR ** 2
+CHART_SENSORS = ('temperature', 'pressure')
+
+
+def budget_capacity(budget, links=1):
+    # Rows per sensor buffer such that the sensor buffers, chart pyramids and
+    # derived metrics of `links` links fit in `budget` bytes. Every row is
+    # stored twice (see RingBuffer), pyramid levels keep one bucket per
+    # PYRAMID_FACTOR rows.
+    columns = sum(map(len, SENSOR_COLUMNS.values())) + sum(map(len, DERIVED_COLUMNS.values()))
+    columns += len(CHART_SENSORS) * PYRAMID_LEVELS * len(BUCKET_COLUMNS) / PYRAMID_FACTOR
+    return max(int(budget / links / (2 * 8 * columns)), MIN_CAPACITY)
+
+
+def _header_field(index):
+    def get(self):
+        return int(self._header[index])
+
+    def set(self, value):
+        self._header[index] = value
+    return property(get, set)
+
+
+def _open(name, create=False, size=0):
+    memory = shared_memory.SharedMemory(name=name, create=create, size=size)
+    # Python < 3.13 registers every segment it opens with the resource
+    # tracker, which removes them when this process exits. Segments outlive
+    # the daemon on purpose and are removed with `ingest.py --cleanup`.
+    resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def _unlink(memory):
+    memory.close()
+    # unlink() unregisters the segment again, which the tracker reports as an error
+    resource_tracker.register(memory._name, 'shared_memory')
+    memory.unlink()
+
+
+class SharedRingBuffer(RingBuffer):
+
+    _sequence = _header_field(SEQUENCE)
+    _head = _header_field(HEAD)
+    _size = _header_field(SIZE)
+    total = _header_field(TOTAL)
+
+    def __init__(self, memory, columns, writable=False):
+        self.memory = memory
+        self._header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+        if self._header[COLUMNS] != len(columns):
+            raise ValueError(f"shared buffer {memory.name} has {self._header[COLUMNS]} columns, expected {len(columns)}")
+        self.columns = tuple(columns)
+        self.capacity = int(self._header[CAPACITY])
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self._storage = np.ndarray(
+            (len(self.columns), 2 * self.capacity), dtype=np.float64, buffer=memory.buf, offset=HEADER_BYTES
+        )
+        if not writable:
+            self._header.flags.writeable = False
+            self._storage.flags.writeable = False
+        self.retries = 0
+        self._stalled = None
+
+    @classmethod
+    def create(cls, name, columns, capacity):
+        # Creates the segment, or empties an existing one of the same shape so
+        # dashboards still attached to it keep working after an ingest restart.
+        size = HEADER_BYTES + len(columns) * 2 * capacity * 8
+        try:
+            memory = _open(name, create=True, size=size)
+            sequence = 0
+        except FileExistsError:
+            memory = _open(name)
+            header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+            if memory.size < size or header[CAPACITY] != capacity or header[COLUMNS] != len(columns):
+                _unlink(memory)
+                return cls.create(name, columns, capacity)
+            # keep the sequence even and moving so readers notice the reset
+            sequence = int(header[SEQUENCE]) + 2 & ~1
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+        header[:] = 0
+        header[SEQUENCE] = sequence
+        header[CAPACITY] = capacity
+        header[COLUMNS] = len(columns)
+        return cls(memory, columns, writable=True)
+
+    @classmethod
+    def attach(cls, name, columns):
+        return cls(_open(name), columns)
+
+
+def segment_name(prefix, link, sensor, level=None):
+    name = f'{prefix}-{link}-{sensor}'
+    return name if level is None else f'{name}-L{level}'
+
+
+def link_nbytes(buffers, pyramids, derived):
+    # memory held by the buffers of one link
+    total = sum(buffer.nbytes for buffer in buffers.values())
+    total += sum(level.nbytes for pyramid in pyramids.values() for level in pyramid.levels)
+    return total + sum(buffer.nbytes for buffer in derived.buffers.values())
+
+
+def create_link_buffers(prefix, link, capacity, derived_window=16, reference_pressure=None):
+    # (sensor buffers, chart pyramids, derived metrics) of one link, written by this process
+    buffers = {
+        sensor: SharedRingBuffer.create(segment_name(prefix, link, sensor), columns, capacity)
+        for sensor, columns in SENSOR_COLUMNS.items()
+    }
+    pyramids = {}
+    for sensor in CHART_SENSORS:
+        levels = [
+            SharedRingBuffer.create(
+                segment_name(prefix, link, sensor, level), BUCKET_COLUMNS, level_capacity(capacity, PYRAMID_FACTOR)
+            )
+            for level in range(PYRAMID_LEVELS)
+        ]
+        pyramids[sensor] = MinMaxPyramid(buffers[sensor], factor=PYRAMID_FACTOR, level_buffers=levels)
+    derived = DerivedMetrics(
+        buffers,
+        window=derived_window,
+        reference_pressure=reference_pressure,
+        outputs={
+            name: SharedRingBuffer.create(segment_name(prefix, link, name), columns, capacity)
+            for name, columns in DERIVED_COLUMNS.items()
+        },
+    )
+    return buffers, pyramids, derived
+
+
+def attach_link_buffers(prefix, link):
+    # read-only (sensor buffers, chart pyramids, derived metrics) of a link another process writes
+    buffers = {
+        sensor: SharedRingBuffer.attach(segment_name(prefix, link, sensor), columns)
+        for sensor, columns in SENSOR_COLUMNS.items()
+    }
+    pyramids = {
+        sensor: MinMaxPyramid(
+            buffers[sensor],
+            factor=PYRAMID_FACTOR,
+            level_buffers=[
+                SharedRingBuffer.attach(segment_name(prefix, link, sensor, level), BUCKET_COLUMNS)
+                for level in range(PYRAMID_LEVELS)
+            ],
+        )
+        for sensor in CHART_SENSORS
+    }
+    derived = DerivedMetrics(
+        buffers,
+        outputs={
+            name: SharedRingBuffer.attach(segment_name(prefix, link, name), columns)
+            for name, columns in DERIVED_COLUMNS.items()
+        },
+    )
+    return buffers, pyramids, derived
+
+
+def unlink_link_buffers(prefix, link):
+    names = [segment_name(prefix, link, sensor) for sensor in [*SENSOR_COLUMNS, *DERIVED_COLUMNS]]
+    names += [segment_name(prefix, link, sensor, level) for sensor in CHART_SENSORS for level in range(PYRAMID_LEVELS)]
+    for name in names:
+        try:
+            memory = _open(name)
+        except FileNotFoundError:
+            continue
+        _unlink(memory)
+
+
+class SharedControl:
+    # Small segment the dashboards use to talk to the ingest daemon: the pid
+    # of the daemon and a counter bumped for every Save Data click.
+
+    def __init__(self, memory):
+        self.memory = memory
+        self._header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+
+    @classmethod
+    def create(cls, prefix):
+        try:
+            memory = _open(f'{prefix}-control', create=True, size=HEADER_BYTES)
+        except FileExistsError:
+            memory = _open(f'{prefix}-control')
+        control = cls(memory)
+        control._header[1] = os.getpid()
+        return control
+
+    @classmethod
+    def attach(cls, prefix):
+        return cls(_open(f'{prefix}-control'))
+
+    @property
+    def pid(self):
+        return int(self._header[1])
+
+    @property
+    def save_requests(self):
+        return int(self._header[0])
+
+    def request_save(self):
+        self._header[0] += 1
+
+    def unlink(self):
+        _unlink(self.memory)
@@ -0,0 +1,326 @@
+import argparse
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from buffers import SENSOR_COLUMNS
+from protocol import FRAME_DTYPE, FRAME_SIZE, TEXT_SYNC, frame_array
+
+# Telemetry sources. Every source looks like a pyserial connection to the
+# reader thread (readline, read, in_waiting), so the live radio, a recorded
+# flight and the synthetic generator are interchangeable.
+
+
+def open_serial(port, baud_rate):
+    import serial
+    # serial_for_url also accepts pty paths and test URLs such as loop://
+    return serial.serial_for_url(port, baud_rate)
+
+
+class StreamSource:
+    # Base for sources whose bytes come from a background producer thread.
+    # Reads block until data is available, like pyserial without a timeout.
+
+    def __init__(self, max_buffered=1 << 16):
+        self.max_buffered = max_buffered
+        self._buffer = bytearray()
+        self._pos = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer) - self._pos
+
+    def _produce(self):
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            self._produce()
+        except EOFError:
+            pass
+        finally:
+            self.close()
+
+    def _emit(self, data):
+        # blocks while the consumer is too far behind, so fast sources measure
+        # how much the reader can take instead of growing without bound
+        with self._condition:
+            while len(self._buffer) - self._pos > self.max_buffered and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                raise EOFError
+            if self._pos > len(self._buffer) // 2:
+                del self._buffer[:self._pos]
+                self._pos = 0
+            self._buffer += data
+            self._condition.notify_all()
+
+    def _take(self, end):
+        data = bytes(self._buffer[self._pos:end])
+        self._pos = end
+        self._condition.notify_all()
+        return data
+
+    def read(self, size=1):
+        with self._condition:
+            while self.in_waiting < size and not self._closed:
+                self._condition.wait()
+            while self.in_waiting == 0:
+                # closed and drained: block like an idle radio link
+                self._condition.wait()
+            return self._take(self._pos + min(size, self.in_waiting))
+
+    def readline(self):
+        with self._condition:
+            while True:
+                end = self._buffer.find(b'\n', self._pos)
+                if end >= 0:
+                    return self._take(end + 1)
+                self._condition.wait()
+
+
+def text_packet(t, sensor_type, values):
+    value = ','.join(repr(float(v)) for v in values)
+    return f"{TEXT_SYNC}\n{t!r}\n{sensor_type}\n{value}\n".encode('utf-8')
+
+
+def replay_packets(data, protocol='text'):
+    # Splits a capture into (time, packet bytes) in the given protocol.
+    if protocol == 'binary':
+        count = len(data) // FRAME_SIZE
+        frames = np.frombuffer(data, dtype=FRAME_DTYPE, count=count)
+        return [(float(t), data[i * FRAME_SIZE:(i + 1) * FRAME_SIZE]) for i, t in enumerate(frames['time'])]
+
+    packets = []
+    lines = data.split(b'\n')
+    i = 0
+    while i + 3 < len(lines):
+        if lines[i].strip() != TEXT_SYNC.encode():
+            i += 1
+            continue
+        try:
+            t = float(lines[i + 1])
+        except ValueError:
+            i += 1
+            continue
+        packets.append((t, b'\n'.join(lines[i:i + 4]) + b'\n'))
+        i += 4
+    return packets
+
+
+class ReplaySource(StreamSource):
+    # Replays a capture file (raw bytes as received from the radio) paced by
+    # the packet timestamps. speed is a multiplier (1 = real time, 100 = 100x),
+    # None replays as fast as the reader accepts.
+
+    def __init__(self, path, speed=1.0, protocol='text', loop=False):
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self.protocol = protocol
+        self.loop = loop
+
+    def _produce(self):
+        with open(self.path, 'rb') as f:
+            packets = replay_packets(f.read(), self.protocol)
+        if not packets:
+            print(f"No packets to replay in {self.path}")
+            return
+        while True:
+            self._replay(packets)
+            print(f"Replay of {self.path} finished")
+            if not self.loop:
+                return
+
+    def _replay(self, packets):
+        first_time = packets[0][0]
+        started = time.monotonic()
+        i = 0
+        while i < len(packets):
+            if self.speed is None:
+                due = len(packets)
+            else:
+                elapsed = (time.monotonic() - started) * self.speed
+                due = i
+                while due < len(packets) and packets[due][0] - first_time <= elapsed:
+                    due += 1
+            if due == i:
+                wait = (packets[i][0] - first_time) / self.speed - (time.monotonic() - started)
+                time.sleep(min(max(wait, 0.0005), 0.05))
+                continue
+            # everything that is due goes out in one write, as on a busy link
+            end = due if self.speed is not None else min(due, i + 256)
+            self._emit(b''.join(packet for _, packet in packets[i:end]))
+            i = end
+
+
+class SyntheticSource(StreamSource):
+    # Generates plausible readings for every sensor at `rate` packets per
+    # second in total (None: as fast as the reader accepts), cycling through
+    # the sensors, in the text or binary protocol. With `count` it stops after
+    # that many packets.
+
+    def __init__(self, rate=100.0, protocol='text', sensors=tuple(SENSOR_COLUMNS), count=None):
+        super().__init__()
+        self.rate = rate
+        self.protocol = protocol
+        self.sensors = list(sensors)
+        self.count = count
+        self.sent = 0
+
+    def reading(self, sensor_type, t):
+        if sensor_type == 'temperature':
+            return [20 + 5 * math.sin(t / 30)]
+        if sensor_type == 'pressure':
+            return [max(101.3 - 0.1 * t, 60) + 0.05 * math.sin(t * 7)]
+        if sensor_type == 'velocity':
+            return [-min(t / 10, 4.5)]
+        if sensor_type == 'light':
+            return [500 + 200 * math.sin(t / 5)]
+        if sensor_type == 'accelerometer':
+            return [9.81 + math.sin(t * 3)]
+        if sensor_type == 'gyroscope':
+            return [(t * 20) % 360 - 180, 30 * math.sin(t / 2), 15 * math.cos(t / 3)]
+        raise ValueError(f"no synthetic data for {sensor_type!r}")
+
+    def packets(self, first, last):
+        # bytes of packets first..last-1, packet i is sensor i % len(sensors) at time i / rate
+        indices = range(first, last)
+        times = [i / self.rate if self.rate else i / 1000 for i in indices]
+        sensors = [self.sensors[i % len(self.sensors)] for i in indices]
+        if self.protocol != 'binary':
+            return b''.join(text_packet(t, sensor, self.reading(sensor, t)) for t, sensor in zip(times, sensors))
+
+        frames = np.empty(last - first, dtype=FRAME_DTYPE)
+        for offset, sensor in enumerate(self.sensors):
+            start = (offset - first) % len(self.sensors)
+            rows = [[t] + self.reading(sensor, t) for t in times[start::len(self.sensors)]]
+            if rows:
+                frames[start::len(self.sensors)] = frame_array(sensor, rows)
+        return frames.tobytes()
+
+    def _produce(self):
+        started = time.monotonic()
+        while self.count is None or self.sent < self.count:
+            if self.rate is None:
+                due = self.sent + 256
+            else:
+                due = int((time.monotonic() - started) * self.rate)
+                if due <= self.sent:
+                    time.sleep(0.001)
+                    continue
+                due = min(due, self.sent + 4096)
+            if self.count is not None:
+                due = min(due, self.count)
+            self._emit(self.packets(self.sent, due))
+            self.sent = due
+
+
+class IdleSource(StreamSource):
+    # No telemetry at all, for reviewing archives or benchmarking the app itself.
+
+    def _produce(self):
+        pass
+
+
+def open_source(kind, port='COM5', baud_rate=115200, replay_file=None, speed=1.0, rate=100.0, protocol='text'):
+    if kind == 'none':
+        return IdleSource().start()
+    if kind == 'serial':
+        return open_serial(port, baud_rate)
+    if kind == 'replay':
+        return ReplaySource(replay_file, speed, protocol).start()
+    if kind == 'synthetic':
+        return SyntheticSource(rate, protocol).start()
+    raise ValueError(f"unknown telemetry source {kind!r}")
+
+
+def parse_links(spec):
+    # 'cansat1=serial:/dev/ttyUSB0,cansat2=serial:/dev/ttyUSB1,sim=synthetic'
+    # -> {'cansat1': ('serial', '/dev/ttyUSB0'), ..., 'sim': ('synthetic', None)}
+    links = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, sep, source = entry.partition('=')
+        if not sep or not name:
+            raise ValueError(f"telemetry link {entry!r} is not name=kind[:target]")
+        kind, _, target = source.partition(':')
+        if name in links:
+            raise ValueError(f"telemetry link {name!r} is defined twice")
+        links[name] = (kind, target or None)
+    return links
+
+
+def parse_speed(value):
+    # '10' -> 10.0, 'max' -> None (as fast as possible)
+    return None if value in (None, '', 'max') else float(value)
+
+
+def parse_size(value):
+    # '512M' -> 536870912, '2G', '64k' or plain bytes, '' -> None
+    if value in (None, ''):
+        return None
+    units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    value = value.strip().lower().rstrip('b')
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main():
+    # Feeds synthetic or replayed telemetry into a file or a pseudo-terminal,
+    # so the dashboard can be run against it as if it were the radio:
+    #
+    #   python sources.py --pty                    # prints the port to use
+    #   SATDASH_SERIAL_PORT=/dev/pts/N python app.py
+    parser = argparse.ArgumentParser(description="Generate or replay CanSat telemetry.")
+    parser.add_argument('--replay', help="capture file to replay instead of synthetic data")
+    parser.add_argument('--speed', default='1', help="replay speed multiplier, or 'max'")
+    parser.add_argument('--rate', default='100', help="synthetic packets per second, or 'max'")
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='text')
+    parser.add_argument('--pty', action='store_true', help="write to a new pseudo-terminal")
+    parser.add_argument('--out', help="write to this file")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    args = parser.parse_args()
+
+    if args.replay:
+        source = ReplaySource(args.replay, parse_speed(args.speed), args.protocol).start()
+    else:
+        source = SyntheticSource(parse_speed(args.rate), args.protocol).start()
+
+    if args.pty:
+        master, slave = os.openpty()
+        print(f"Telemetry on {os.ttyname(slave)}")
+        write = lambda data: os.write(master, data)
+    else:
+        out = open(args.out, 'wb') if args.out else os.fdopen(1, 'wb')
+        write = out.write
+
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            write(source.read(max(1, source.in_waiting)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        if not args.pty:
+            out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import json
+import queue
+import threading
+import time
+
+# seconds between two events, updates arriving in between are batched
+FRAME_INTERVAL = 0.035
+# comment line sent to idle subscribers so dead connections get noticed
+KEEPALIVE_INTERVAL = 15
+# events a slow subscriber may fall behind before it is resynced with a snapshot
+SUBSCRIBER_QUEUE_SIZE = 64
+
+
+def sse_message(payload):
+    return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+class Broadcaster:
+    # Pushes new readings to every connected browser as Server-Sent Events.
+    #
+    # The ingest thread calls notify() with the sensors it just wrote to. A
+    # single flush thread wakes up, waits for the end of the current frame so
+    # a burst of packets becomes one event, encodes that event once and hands
+    # it to every subscriber queue. With no new packets nothing runs at all.
+    #
+    # Every sensor entry carries the buffer's sequence number after its last
+    # row, so a client can drop rows it already got from a snapshot. When a
+    # sequence number goes backwards (a restarted ingest.py emptied the
+    # shared buffers) every subscriber gets a fresh snapshot instead.
+
+    def __init__(self, buffers, history_sensors=(), window=2000, frame_interval=FRAME_INTERVAL):
+        self.buffers = buffers
+        # sensors whose new rows are all sent (for charts), others only send their latest row
+        self.history_sensors = set(history_sensors)
+        self.window = window
+        self.frame_interval = frame_interval
+        self._condition = threading.Condition()
+        self._dirty = set()
+        self._subscribers = set()
+        self._seen = {sensor: buffer.total for sensor, buffer in buffers.items()}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def notify(self, sensor_types):
+        with self._condition:
+            self._dirty.update(sensor_types)
+            self._condition.notify()
+
+    def _run(self):
+        last_flush = 0
+        while True:
+            with self._condition:
+                while not self._dirty:
+                    self._condition.wait()
+            delay = last_flush + self.frame_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._condition:
+                dirty, self._dirty = self._dirty, set()
+                subscribers = list(self._subscribers)
+            last_flush = time.monotonic()
+
+            if not subscribers:
+                # new subscribers start from a snapshot anyway
+                for sensor in dirty:
+                    self._seen[sensor] = self.buffers[sensor].total
+                continue
+            if any(self.buffers[sensor].total < self._seen[sensor] for sensor in dirty):
+                self._seen = {sensor: buffer.total for sensor, buffer in self.buffers.items()}
+                for subscriber in subscribers:
+                    self._resync(subscriber)
+                continue
+            event = self._collect(dirty)
+            if not event['sensors']:
+                continue
+            message = sse_message(event)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # too far behind, drop its backlog and send a snapshot instead
+                    self._resync(subscriber)
+
+    @staticmethod
+    def _resync(subscriber):
+        # replaces whatever the subscriber has queued with a snapshot
+        with subscriber.mutex:
+            subscriber.queue.clear()
+        subscriber.put_nowait(None)
+
+    def _collect(self, sensor_types):
+        sensors = {}
+        for sensor in sensor_types:
+            count = self.window if sensor in self.history_sensors else 1
+            rows, total = self.buffers[sensor].snapshot(count, since=self._seen[sensor])
+            self._seen[sensor] = total
+            if rows.shape[1]:
+                sensors[sensor] = {'total': total, 'rows': rows.T.tolist()}
+        return {'reset': False, 'sensors': sensors}
+
+    def snapshot(self):
+        sensors = {}
+        for sensor, buffer in self.buffers.items():
+            count = self.window if sensor in self.history_sensors else 1
+            rows, total = buffer.snapshot(count)
+            if rows.shape[1]:
+                sensors[sensor] = {'total': total, 'rows': rows.T.tolist()}
+        return {'reset': True, 'sensors': sensors}
+
+    def events(self):
+        # Generator of SSE text for one subscriber, starting with a full snapshot.
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._condition:
+            self._subscribers.add(subscriber)
+        try:
+            yield sse_message(self.snapshot())
+            while True:
+                try:
+                    message = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield sse_message(self.snapshot()) if message is None else message
+        finally:
+            with self._condition:
+                self._subscribers.discard(subscriber)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from buffers import RingBuffer
+from downsample import MinMaxPyramid
+
+
+def filled_pyramid(capacity, rows, batch=97):
+    # readings every 10 ms, appended in batches like the binary reader does
+    buffer = RingBuffer(('time', 'value'), capacity)
+    pyramid = MinMaxPyramid(buffer)
+    times = np.arange(rows) * 0.01
+    for first in range(0, rows, batch):
+        chunk = times[first:first + batch]
+        buffer.extend(np.column_stack([chunk, np.sin(chunk)]))
+        pyramid.update()
+    return pyramid
+
+
+def test_zoom_older_than_raw_ring():
+    # 3000 s of readings, the raw ring only holds the last 1000 s
+    pyramid = filled_pyramid(100_000, 300_000)
+    (times, values), total = pyramid.query(500, 600)
+    assert total == 300_000
+    assert len(times) > 0
+    assert times[0] <= 501 and times[-1] >= 599
+    assert np.all(np.diff(times) >= 0)
+
+
+def test_zoom_within_one_bucket():
+    pyramid = filled_pyramid(1000, 3000)
+    (times, _), _ = pyramid.query(1, 2)
+    assert len(times) > 0
+
+
+def test_whole_flight_with_small_capacity():
+    pyramid = filled_pyramid(1000, 3000)
+    (times, _), _ = pyramid.query(max_points=500)
+    assert times[0] < 3 and times[-1] == 2999 * 0.01
+    assert len(times) <= 500
+    assert np.all(np.diff(times) >= 0)
+
+
+def test_exact_points_while_they_fit():
+    pyramid = filled_pyramid(1000, 300)
+    (times, values), total = pyramid.query(max_points=500)
+    assert total == 300
+    np.testing.assert_array_equal(times, np.arange(300) * 0.01)
+    np.testing.assert_array_equal(values, np.sin(times))
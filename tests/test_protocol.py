@@ -0,0 +1,60 @@
+import numpy as np
+
+from protocol import FRAME_SIZE, SYNC_BYTES, BinaryDecoder, crc16, encode_frames, frame_array
+
+
+def pressure_rows(count, first=0):
+    # values exact in float32, so they round-trip unchanged
+    times = (first + np.arange(count)) * 0.5
+    return np.column_stack([times, 1000 + times])
+
+
+def decode_all(decoder, chunks):
+    rows = [decoder.decode(chunk).get('pressure', np.empty((0, 2))) for chunk in chunks]
+    return np.concatenate(rows)
+
+
+def test_round_trip_with_crc():
+    rows = pressure_rows(10)
+    frames = frame_array('pressure', rows)
+    raw = frames.view(np.uint8).reshape(len(rows), FRAME_SIZE)
+    np.testing.assert_array_equal(crc16(raw[:, :-2]), frames['crc'])
+
+    decoder = BinaryDecoder()
+    batches = decoder.decode(encode_frames('pressure', rows))
+    np.testing.assert_array_equal(batches['pressure'], rows)
+    gyroscope = np.array([[1.0, 10.0, -20.0, 30.5]])
+    np.testing.assert_array_equal(decoder.decode(encode_frames('gyroscope', gyroscope))['gyroscope'], gyroscope)
+    assert decoder.frames == 11 and decoder.bad_frames == 0
+
+
+def test_corrupted_byte_loses_one_frame():
+    rows = pressure_rows(10)
+    data = bytearray(encode_frames('pressure', rows))
+    # a value byte of the fifth frame
+    data[4 * FRAME_SIZE + 9] ^= 0xFF
+    decoder = BinaryDecoder()
+    decoded = decoder.decode(bytes(data))['pressure']
+    np.testing.assert_array_equal(decoded, np.delete(rows, 4, axis=0))
+    assert decoder.bad_frames == 1
+
+
+def test_frames_split_across_chunks():
+    rows = pressure_rows(50)
+    data = encode_frames('pressure', rows)
+    cuts = [0, 1, 7, FRAME_SIZE + 3, 300, 301, 650, len(data)]
+    decoder = BinaryDecoder()
+    decoded = decode_all(decoder, [data[a:b] for a, b in zip(cuts, cuts[1:])])
+    np.testing.assert_array_equal(decoded, rows)
+    assert decoder.bad_frames == 0
+
+
+def test_sync_word_split_at_chunk_end():
+    rows = pressure_rows(3)
+    data = encode_frames('pressure', rows)
+    # garbage, then a chunk ending in the first byte of a sync word
+    first = b'\x00\x13\x37' + data[:1]
+    assert first.endswith(SYNC_BYTES[:1])
+    decoder = BinaryDecoder()
+    decoded = decode_all(decoder, [first, data[1:]])
+    np.testing.assert_array_equal(decoded, rows)
@@ -0,0 +1,44 @@
+import numpy as np
+
+from archive import FlightArchive
+from buffers import RingBuffer
+from query import LiveBlockIndex, aggregate_rows
+
+
+def readings(first, count):
+    times = (first + np.arange(count)) * 0.01
+    return np.column_stack([times, np.sin(times)])
+
+
+def test_live_index_matches_a_scan_of_the_ring():
+    buffer = RingBuffer(('time', 'value'), 20_000)
+    index = LiveBlockIndex(buffer)
+    for first in range(0, 60_000, 3000):
+        buffer.extend(readings(first, 3000))
+        index.update()
+    rows, _ = buffer.snapshot()
+    for start, end in [(450, 590), (400.005, 430.01), (590, None)]:
+        expected = aggregate_rows(rows.T, buffer.columns, start, end)
+        result = index.aggregate(start, end)
+        assert result['count'] == expected['count']
+        np.testing.assert_allclose(result['fields']['value']['sum'], expected['fields']['value']['sum'])
+        assert result['fields']['value']['max'] == expected['fields']['value']['max']
+
+
+def test_live_index_keeps_summaries_older_than_the_ring():
+    buffer = RingBuffer(('time', 'value'), 20_000)
+    index = LiveBlockIndex(buffer)
+    for first in range(0, 60_000, 3000):
+        buffer.extend(readings(first, 3000))
+        index.update()
+    assert index.aggregate()['count'] == 60_000
+
+
+def test_archive_points_of_a_long_range(tmp_path):
+    archive = FlightArchive.create(str(tmp_path), 'flight')
+    archive.append('pressure', readings(0, 2_000_000))
+    times, values = archive.points('pressure', 1, 1000, 15000, max_points=500)
+    assert 200 < len(times) <= 510
+    assert times[0] >= 1000 and times[-1] <= 15000
+    assert np.all(np.diff(times) >= 0)
+    np.testing.assert_allclose(values, np.sin(times))
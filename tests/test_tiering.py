@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+
+import ingest
+from archive import ArchiveSink
+from buffers import make_sensor_buffers
+from charts import zoomed_rows
+from downsample import MinMaxPyramid
+from persistence import BackgroundWriter
+from wal import LogSink, PacketLog
+from shared import MIN_CAPACITY, PYRAMID_FACTOR, budget_capacity
+
+
+def test_budgeted_run_charts_the_whole_flight(tmp_path):
+    # 12 s of temperature at 1 kHz into buffers sized for a 1 MB budget
+    buffers = make_sensor_buffers(budget_capacity(1 << 20))
+    pyramid = MinMaxPyramid(buffers['temperature'], factor=PYRAMID_FACTOR)
+    spill = BackgroundWriter(buffers, [ArchiveSink(str(tmp_path))])
+    for first in range(0, 12_000, 200):
+        times = (first + np.arange(200)) * 0.001
+        buffers['temperature'].extend(np.column_stack([times, np.sin(times)]))
+        pyramid.update()
+        spill.save()
+    archive = spill.sinks[0].archive
+    assert not buffers['temperature'].reaches(0)
+
+    (times, _), _ = pyramid.query(max_points=500)
+    assert times[0] < 0.1 and times[-1] == 11_999 * 0.001
+
+    times, values = zoomed_rows(buffers['temperature'], 500, pyramid, 1, 3, archive, 'temperature')
+    assert times[0] == 1 and times[-1] == 3
+    assert 250 <= len(times) <= 510
+    np.testing.assert_allclose(values, np.sin(times))
+
+
+def test_tiny_budget_still_fills_every_level():
+    capacity = budget_capacity(1000)
+    assert capacity == MIN_CAPACITY
+    buffers = make_sensor_buffers(capacity)
+    pyramid = MinMaxPyramid(buffers['temperature'], factor=PYRAMID_FACTOR)
+    times = np.arange(PYRAMID_FACTOR ** 4) * 0.001
+    for first in range(0, len(times), capacity // 2):
+        chunk = times[first:first + capacity // 2]
+        buffers['temperature'].extend(np.column_stack([chunk, np.sin(chunk)]))
+        pyramid.update()
+    assert all(level.total for level in pyramid.levels)
+
+
+def test_restart_spills_the_recovered_readings(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'WAL_DIR', str(tmp_path / 'wal'))
+    monkeypatch.setattr(ingest, 'SPILL', True)
+    monkeypatch.setattr(ingest, 'SPILL_DIR', str(tmp_path / 'spill'))
+    (tmp_path / 'wal').mkdir()
+    times = np.arange(5000) * 0.001
+    rows = np.column_stack([times, np.sin(times)])
+
+    # first run: logged everything, crashed before spilling the last 1000 readings
+    buffers = make_sensor_buffers(MIN_CAPACITY)
+    log = BackgroundWriter(buffers, [LogSink(PacketLog(ingest.log_path('main')))])
+    spill = ingest.spill_writer('main', buffers)
+    for first in range(0, 3000, 100):
+        buffers['temperature'].extend(rows[first:first + 100])
+        log.save()
+        spill.save()
+    for first in range(3000, 4000, 100):
+        buffers['temperature'].extend(rows[first:first + 100])
+        log.save()
+    log.sinks[0].log.close()
+
+    # restart: empty buffers refilled from the packet log
+    buffers = make_sensor_buffers(MIN_CAPACITY)
+    spill = ingest.spill_writer('main', buffers)
+    ingest.recover_link('main', buffers, {}, ingest.derived_metrics(buffers), spill)
+    for first in range(4000, 5000, 100):
+        buffers['temperature'].extend(rows[first:first + 100])
+        spill.save()
+
+    # the newest session, the one the dashboard charts from, has the whole flight
+    sessions = sorted(os.listdir(tmp_path / 'spill' / 'main'))
+    assert len(sessions) == 2
+    archive = spill.sinks[0].archive
+    assert archive.path == str(tmp_path / 'spill' / 'main' / sessions[-1])
+    assert sum(spill.dropped.values()) == 0
+    np.testing.assert_array_equal(archive.rows('temperature'), rows)
+
+
+def test_zoom_ignores_an_archive_that_stops_short(tmp_path):
+    # Save Data pressed once, 500 s in, then 4500 s more into a 1000 row ring
+    buffers = make_sensor_buffers(1000)
+    pyramid = MinMaxPyramid(buffers['temperature'], factor=PYRAMID_FACTOR)
+    saves = BackgroundWriter(buffers, [ArchiveSink(str(tmp_path))])
+    for first in range(0, 5000, 100):
+        times = first + np.arange(100.0)
+        buffers['temperature'].extend(np.column_stack([times, np.sin(times)]))
+        pyramid.update()
+        if first == 500:
+            saves.save()
+    archive = saves.sinks[0].archive
+    assert not archive.reaches('temperature', 1000, buffers['temperature'].span()[1])
+
+    times, _ = zoomed_rows(buffers['temperature'], 500, pyramid, 1000, 2000, archive, 'temperature')
+    expected, _ = zoomed_rows(buffers['temperature'], 500, pyramid, 1000, 2000)
+    assert len(times) > 0
+    np.testing.assert_array_equal(times, expected)
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from buffers import make_sensor_buffers
+from downsample import MinMaxPyramid
+from wal import LOG_MAGIC, LOG_RECORD_SIZE, PacketLog, recover
+
+
+def pressure_rows(count, first=0):
+    times = (first + np.arange(count)) * 0.01
+    return np.column_stack([times, 1000 + np.sin(times)])
+
+
+def test_torn_tail_is_cut_and_appending_resumes(tmp_path):
+    path = str(tmp_path / 'main.wal')
+    log = PacketLog(path)
+    log.append('pressure', pressure_rows(10))
+    log.close()
+    # a crash in the middle of writing the eleventh record
+    with open(path, 'ab') as f:
+        f.write(b'\x02' * (LOG_RECORD_SIZE // 2))
+
+    log = PacketLog(path)
+    log.append('pressure', pressure_rows(5, first=10))
+    log.close()
+    assert os.path.getsize(path) == len(LOG_MAGIC) + 15 * LOG_RECORD_SIZE
+    buffers = make_sensor_buffers(100)
+    loaded, bad = recover(PacketLog(path), buffers)
+    assert loaded == {'pressure': 15} and bad == 0
+    np.testing.assert_array_equal(buffers['pressure'].snapshot()[0].T, pressure_rows(15))
+
+
+def test_corrupted_record_is_skipped_and_counted(tmp_path):
+    path = str(tmp_path / 'main.wal')
+    log = PacketLog(path)
+    log.append('pressure', pressure_rows(10))
+    log.close()
+    with open(path, 'r+b') as f:
+        # a value byte of the fourth record
+        f.seek(len(LOG_MAGIC) + 3 * LOG_RECORD_SIZE + 12)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    buffers = make_sensor_buffers(100)
+    loaded, bad = recover(PacketLog(path), buffers)
+    assert loaded == {'pressure': 9} and bad == 1
+    np.testing.assert_array_equal(buffers['pressure'].snapshot()[0].T, np.delete(pressure_rows(10), 3, axis=0))
+
+
+def test_recovering_a_long_log_fills_the_pyramid(tmp_path):
+    path = str(tmp_path / 'main.wal')
+    log = PacketLog(path)
+    log.append('pressure', pressure_rows(100_000))
+    log.close()
+
+    buffers = make_sensor_buffers(1000)
+    pyramid = MinMaxPyramid(buffers['pressure'])
+    loaded, _ = recover(PacketLog(path), buffers, lambda sensor_type: pyramid.update())
+    assert loaded == {'pressure': 100_000}
+    # every reading went through the pyramid, not just the last buffer's worth
+    assert [level.total for level in pyramid.levels[:3]] == [6250, 390, 24]
+    assert pyramid.levels[2].snapshot()[0][0, 0] == 0
+    (times, _), _ = pyramid.query(max_points=500)
+    assert times[-1] == 99_999 * 0.01
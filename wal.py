@@ -0,0 +1,193 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from archive import FlightArchive
+from buffers import SENSOR_COLUMNS
+from protocol import SENSOR_CODES, SENSOR_IDS, crc16
+
+# Crash-safe write-ahead log of every reading, so a crash or restart
+# mid-flight loses at most the last flush interval instead of everything
+# since the last Save Data.
+#
+# A log is one append-only file per link: an 8-byte magic followed by
+# fixed-size little-endian records
+#
+#   sensor u1     see protocol.SENSOR_IDS
+#   time   f8     seconds
+#   values 3xf8   the sensor's values, unused slots are 0
+#   crc    u2     CRC-16/CCITT-FALSE over the preceding 33 bytes
+#
+# A crash can leave a torn record at the end, which is cut off when the log
+# is opened for writing again, and recovery skips records failing their CRC.
+# Writes go through a buffered file that is flushed after every batch and
+# fsynced at most every `sync_interval` seconds. Recovery memory-maps the file
+# and decodes it in large vectorized chunks, so hours of data load in seconds.
+
+LOG_MAGIC = b'SATWAL1\n'
+LOG_DTYPE = np.dtype([
+    ('sensor', 'u1'),
+    ('time', '<f8'),
+    ('values', '<f8', (3,)),
+    ('crc', '<u2'),
+])
+LOG_RECORD_SIZE = LOG_DTYPE.itemsize
+
+
+def _record_bytes(records):
+    # (n,) records -> (n, LOG_RECORD_SIZE) uint8
+    return records.view(np.uint8).reshape(len(records), LOG_RECORD_SIZE)
+
+
+def encode_records(sensor_type, rows):
+    # rows: (n, len(SENSOR_COLUMNS[sensor_type])) array of time + values
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(SENSOR_COLUMNS[sensor_type]))
+    records = np.zeros(len(rows), dtype=LOG_DTYPE)
+    records['sensor'] = SENSOR_CODES[sensor_type]
+    records['time'] = rows[:, 0]
+    records['values'][:, :rows.shape[1] - 1] = rows[:, 1:]
+    records['crc'] = crc16(_record_bytes(records)[:, :-2])
+    return records.tobytes()
+
+
+def decode_records(records):
+    # Returns {sensor: (n, columns) rows} of the records passing their CRC,
+    # and the number of records that failed it.
+    records = np.ascontiguousarray(records)
+    valid = crc16(_record_bytes(records)[:, :-2]) == records['crc']
+    valid &= np.isin(records['sensor'], list(SENSOR_IDS))
+    good = records[valid]
+    batches = {}
+    for code in np.unique(good['sensor']).tolist():
+        sensor_type = SENSOR_IDS[code]
+        selected = good[good['sensor'] == code]
+        width = len(SENSOR_COLUMNS[sensor_type])
+        batches[sensor_type] = np.column_stack([selected['time'], selected['values'][:, :width - 1]])
+    return batches, int((~valid).sum())
+
+
+class PacketLog:
+
+    def __init__(self, path, sync_interval=1.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self._file = None
+        self._last_sync = time.monotonic()
+
+    def _open(self):
+        # creates the log, or reopens it cutting off a torn record at the end
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < len(LOG_MAGIC):
+            self._file = open(self.path, 'wb')
+            self._file.write(LOG_MAGIC)
+            return
+        self._file = open(self.path, 'r+b')
+        if self._file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            self._file.close()
+            self._file = None
+            raise ValueError(f"{self.path} is not a packet log")
+        whole = len(LOG_MAGIC) + (size - len(LOG_MAGIC)) // LOG_RECORD_SIZE * LOG_RECORD_SIZE
+        if whole != size:
+            self._file.truncate(whole)
+        self._file.seek(whole)
+
+    def append(self, sensor_type, rows):
+        if self._file is None:
+            self._open()
+        self._file.write(encode_records(sensor_type, rows))
+        # in the OS page cache now, survives a crash of this process
+        self._file.flush()
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        # on disk now, survives a power loss too
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def count(self):
+        # whole records in the log
+        if not os.path.exists(self.path):
+            return 0
+        return max(os.path.getsize(self.path) - len(LOG_MAGIC), 0) // LOG_RECORD_SIZE
+
+    def chunks(self, chunk_records=1 << 20):
+        # Yields ({sensor: rows}, bad records) for consecutive chunks of the log.
+        count = self.count()
+        if count == 0:
+            return
+        with open(self.path, 'rb') as f:
+            if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+                raise ValueError(f"{self.path} is not a packet log")
+        records = np.memmap(self.path, dtype=LOG_DTYPE, mode='r', offset=len(LOG_MAGIC), shape=(count,))
+        for first in range(0, count, chunk_records):
+            yield decode_records(records[first:first + chunk_records])
+
+
+class LogSink:
+    # BackgroundWriter sink appending to a PacketLog.
+
+    def __init__(self, log):
+        self.log = log
+
+    def write(self, sensor_type, view):
+        self.log.append(sensor_type, view.T)
+
+
+def recover(log, buffers, extended=None):
+    # Refills sensor buffers from a packet log, oldest records first, so each
+    # buffer ends up with the most recent rows that fit. extended(sensor_type)
+    # is called after every extend, at most half a buffer apart, so whatever
+    # it updates from the buffer (chart pyramids, derived metrics) sees every
+    # row. Returns the rows loaded per sensor and the number of corrupt
+    # records skipped.
+    loaded = {}
+    bad = 0
+    for batches, chunk_bad in log.chunks():
+        bad += chunk_bad
+        for sensor_type, rows in batches.items():
+            buffer = buffers[sensor_type]
+            step = max(buffer.capacity // 2, 1)
+            for first in range(0, len(rows), step):
+                buffer.extend(rows[first:first + step])
+                if extended is not None:
+                    extended(sensor_type)
+            loaded[sensor_type] = loaded.get(sensor_type, 0) + len(rows)
+    return loaded, bad
+
+
+def export_archive(log, archive_directory='flights', session=None):
+    # Converts a whole packet log into a flight archive.
+    archive = FlightArchive.create(archive_directory, session)
+    for batches, _ in log.chunks():
+        for sensor_type, rows in batches.items():
+            archive.append(sensor_type, rows)
+    return archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a SatDash packet log into a flight archive.")
+    parser.add_argument('log', help="packet log written by the dashboard or ingest.py")
+    parser.add_argument('--archive', default='flights', help="archive directory")
+    parser.add_argument('--session', help="session name, the current time by default")
+    args = parser.parse_args()
+
+    archive = export_archive(PacketLog(args.log), args.archive, args.session)
+    print(f"Wrote {args.log} to {archive.path}")
+
+
+if __name__ == '__main__':
+    main()